@@ -0,0 +1,156 @@
+import re
+import time
+import logging
+
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+# ========== CONFIG ==========
+MEDIA_TIMEOUT = 120        # Seconds for every selected image to upload and finish processing
+SAVE_TIMEOUT = 30          # Seconds for the save to be confirmed
+NETWORK_IDLE = 0.5         # Seconds without an in-flight request that count as idle
+POLL = 0.25
+# Admin UI selectors; kept here so a Polaris markup change is a config edit
+MEDIA_THUMBNAIL_SELECTOR = "[data-media-id] img, .Polaris-DropZone ~ * img, [class*='MediaCard'] img"
+MEDIA_BUSY_SELECTOR = ".Polaris-Spinner, .Polaris-ProgressBar, [role='progressbar'], [aria-busy='true']"
+TOAST_SELECTOR = ".Polaris-Frame-Toast:not(.Polaris-Frame-Toast--error)"
+TOAST_ERROR_SELECTOR = ".Polaris-Frame-Toast--error"
+TOAST_SAVED_WORDS = ("saved", "created")
+TOAST_FAILED_WORDS = ("couldn't", "could not", "not saved", "error", "failed")
+# ============================
+
+PRODUCT_URL_RE = re.compile(r"/products/(\d+)")
+
+
+class SaveFailed(Exception):
+    """The admin showed an error toast for the save."""
+
+# Counts fetch/XHR requests in flight so waits can tell when the admin UI has gone quiet
+NETWORK_TRACKER_JS = """
+(function () {
+  if (window.__pendingRequests !== undefined) return;
+  window.__pendingRequests = 0;
+  window.__lastRequestEnd = Date.now();
+  var done = function () { window.__pendingRequests--; window.__lastRequestEnd = Date.now(); };
+  var fetch = window.fetch;
+  if (fetch) {
+    window.fetch = function () {
+      window.__pendingRequests++;
+      return fetch.apply(this, arguments).finally(done);
+    };
+  }
+  var send = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function () {
+    window.__pendingRequests++;
+    this.addEventListener("loadend", done, {once: true});
+    return send.apply(this, arguments);
+  };
+})();
+"""
+
+NETWORK_IDLE_JS = """
+if (window.__pendingRequests === undefined) return null;
+return window.__pendingRequests <= 0 ? Date.now() - window.__lastRequestEnd : -1;
+"""
+
+# [loaded thumbnails, busy indicators]; a thumbnail counts once its image has decoded
+MEDIA_STATE_JS = """
+var thumbs = Array.from(document.querySelectorAll(arguments[0]));
+var loaded = thumbs.filter(function (img) { return img.complete && img.naturalWidth > 0; }).length;
+return [loaded, document.querySelectorAll(arguments[1]).length];
+"""
+
+TOAST_TEXT_JS = """
+return Array.from(document.querySelectorAll(arguments[0])).map(function (el) { return el.innerText; }).join(" ");
+"""
+
+# href of the first product link whose text is exactly the title, on the (filtered) admin products list
+PRODUCT_LINK_JS = """
+var title = arguments[0];
+var link = Array.from(document.querySelectorAll("a[href*='/products/']")).find(function (a) {
+  return a.innerText.trim() === title;
+});
+return link ? link.getAttribute("href") : null;
+"""
+
+
+def install_network_tracker(driver):
+    """Inject the request counter into every document the driver loads (Chrome only), and the current one."""
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": NETWORK_TRACKER_JS})
+    except (AttributeError, WebDriverException) as e:
+        logging.info(f"CDP unavailable, network tracker only covers pages it is re-injected into: {e}")
+    ensure_network_tracker(driver)
+
+
+def ensure_network_tracker(driver):
+    driver.execute_script(NETWORK_TRACKER_JS)
+
+
+def wait_network_idle(driver, timeout=10, idle=NETWORK_IDLE):
+    """Wait until no fetch/XHR has been in flight for `idle` seconds. Returns False on timeout."""
+    def quiet(d):
+        idle_ms = d.execute_script(NETWORK_IDLE_JS)
+        return idle_ms is None or idle_ms >= idle * 1000  # No tracker on this page: nothing to wait for
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=POLL).until(quiet)
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_media_processed(driver, expected, baseline=0, timeout=MEDIA_TIMEOUT):
+    """Wait until `expected` new thumbnails have loaded, nothing shows progress and the network is quiet.
+
+    baseline is the thumbnail count before the files were sent. Returns False on timeout.
+    """
+    def ready(d):
+        loaded, busy = d.execute_script(MEDIA_STATE_JS, MEDIA_THUMBNAIL_SELECTOR, MEDIA_BUSY_SELECTOR)
+        return loaded - baseline >= expected and not busy
+
+    started = time.monotonic()
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=POLL).until(ready)
+    except TimeoutException:
+        return False
+    return wait_network_idle(driver, timeout=max(1, timeout - (time.monotonic() - started)))
+
+
+def media_count(driver):
+    return driver.execute_script(MEDIA_STATE_JS, MEDIA_THUMBNAIL_SELECTOR, MEDIA_BUSY_SELECTOR)[0]
+
+
+def wait_saved(driver, timeout=SAVE_TIMEOUT):
+    """Wait for the URL to become /products/<id> or for a success toast.
+
+    Returns the product ID, True (success toast only) or None on timeout; raises SaveFailed on an error toast.
+    """
+    result = {}
+
+    def saved(d):
+        match = PRODUCT_URL_RE.search(d.current_url)
+        if match:
+            result["id"] = match.group(1)
+            return True
+        error = d.execute_script(TOAST_TEXT_JS, TOAST_ERROR_SELECTOR)
+        if error:
+            result["error"] = error
+            return True
+        toast = (d.execute_script(TOAST_TEXT_JS, TOAST_SELECTOR) or "").lower()
+        return (any(word in toast for word in TOAST_SAVED_WORDS)
+                and not any(word in toast for word in TOAST_FAILED_WORDS))
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=POLL).until(saved)
+    except TimeoutException:
+        return None
+    if "error" in result:
+        raise SaveFailed(result["error"].strip())
+    return result.get("id", True)
+
+
+def product_link_id(driver, title):
+    """ID of the product listed on the current page under exactly this title, or None."""
+    match = PRODUCT_URL_RE.search(driver.execute_script(PRODUCT_LINK_JS, title) or "")
+    return match.group(1) if match else None
@@ -0,0 +1,554 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import functools
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import METRICS, percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# ========== CONFIG ==========
+ALBUMS = 40
+IMAGES_PER_ALBUM = 5
+SHARED_IMAGES = 1              # Last photos of every album are the same filler shot (dust bag, box)
+BRAND_PAGES = 40
+IMAGE_SIZE = (1600, 1200)
+API_BUCKET = (1000, 50)        # Mock Admin API leaky bucket: maximum points, points restored per second
+API_LATENCY = 0.05            # Seconds the mock Admin API takes per GraphQL request
+LLM_LATENCY = 0.2             # Seconds the stub chat-completions endpoint takes per request
+REGRESSION_THRESHOLD = 0.20   # Fail the comparison when a metric is 20% worse than the baseline
+# ============================
+
+CATEGORY_ID = "424242"
+
+
+def _fixture_image(album, index):
+    """Deterministic JPEG bytes for one album photo."""
+    seed = int(hashlib.md5(f"{album}-{index}".encode()).hexdigest()[:6], 16)
+    if Image is None:
+        rng = hashlib.sha256(str(seed).encode()).digest()
+        return b"\xff\xd8\xff\xe0" + rng * (150000 // len(rng)) + b"\xff\xd9"
+    color = (seed & 255, (seed >> 8) & 255, (seed >> 16) & 255)
+    img = Image.new("RGB", IMAGE_SIZE, color)
+    # A few bands so thumbnails and perceptual hashes differ between photos
+    for band in range(8):
+        shade = tuple((c + band * 29 + index * 17) % 256 for c in color)
+        img.paste(shade, (band * IMAGE_SIZE[0] // 8, 0, (band + 1) * IMAGE_SIZE[0] // 8, IMAGE_SIZE[1] // (index + 2)))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+
+def _category_page(base, albums):
+    links = "\n".join(f'<a class="album__main" href="/albums/{k}?uid=1" title="Fixture Bag {k}">'
+                      f'<img src="{base}/photos/{k}/0.jpg"></a>' for k in range(albums))
+    return (f"<html><head><title>Fixture store</title></head><body>"
+            f'<nav><a href="/categories/{CATEGORY_ID}">Fixture Bags</a></nav>'
+            f'<div class="categories__children">{links}</div></body></html>')
+
+
+def _album_page(base, album, images):
+    imgs = "\n".join(f'<div class="image__imagewrap"><img class="autocover image__img image__portrait" '
+                     f'data-type="photo" data-origin-src="{base}/photos/{album}/{j}.jpg" src="/s/{j}.jpg"></div>'
+                     for j in range(images))
+    return f"<html><head><title>Fixture Bag {album}</title></head><body>{imgs}</body></html>"
+
+
+def _brand_page(page):
+    product = {
+        "@context": "https://schema.org", "@type": "Product",
+        "name": f"Fixture Leather Tote {page}",
+        "description": f"Structured tote {page} in grained calfskin with a detachable strap and zip pocket.",
+    }
+    details = "".join(f"<li>Dimensions: {20 + i} x {15 + i} x 8 cm</li><li>Material: calfskin leather</li>"
+                      for i in range(30))
+    filler = "".join(f"<p>Editorial paragraph {i} about the collection and the house.</p>" for i in range(200))
+    return (f"<html><head><title>Fixture Leather Tote {page}</title>"
+            f'<meta property="og:title" content="Fixture Leather Tote {page}">'
+            f'<meta name="description" content="A structured everyday tote.">'
+            f'<script type="application/ld+json">{json.dumps(product)}</script></head>'
+            f"<body><ul>{details}</ul>{filler}</body></html>")
+
+
+def _completion(content):
+    return {"id": "chatcmpl-fixture", "object": "chat.completion", "created": int(time.time()), "model": "fixture",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 40, "total_tokens": 340}}
+
+
+ADMIN_FORM = """<html><head><title>Add product</title></head><body>
+<form method="post" action="/admin/products" enctype="multipart/form-data">
+<input name="title">
+<iframe id="product-description_ifr" srcdoc="<body id='tinymce' contenteditable='true'></body>"></iframe>
+<input name="price"><input name="productType"><input name="inventoryLevels[0]">
+<input type="file" name="media" multiple>
+<div id="media"></div>
+<button type="submit">Save</button>
+</form>
+<script>
+// Mimics the admin media grid: a spinner per file, then a thumbnail once "processing" is done
+document.querySelector("input[type=file]").addEventListener("change", function (e) {
+  Array.from(e.target.files).forEach(function (file, i) {
+    var card = document.createElement("div");
+    card.setAttribute("data-media-id", String(i));
+    card.innerHTML = "<div class='Polaris-Spinner'></div>";
+    document.getElementById("media").appendChild(card);
+    setTimeout(function () {
+      var img = document.createElement("img");
+      img.src = URL.createObjectURL(file);
+      card.innerHTML = "";
+      card.appendChild(img);
+    }, 200);
+  });
+});
+</script></body></html>"""
+
+
+class FixtureServer:
+    """Local HTTP server replaying Yupoo, brand-site and Shopify admin fixtures, counting bytes served."""
+
+    def __init__(self, albums=ALBUMS, images=IMAGES_PER_ALBUM, brand_pages=BRAND_PAGES):
+        self.albums = albums
+        self.images = images
+        self.brand_pages = brand_pages
+        self.bytes_sent = 0
+        self.requests = 0
+        self.products = 0
+        self.api_products = 0
+        self.staged = 0
+        self.media = 0
+        self.media_refs = 0
+        self.api_points = float(API_BUCKET[0])
+        self.api_updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._image_cache = {}
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _count(self, sent):
+        with self._lock:
+            self.bytes_sent += sent
+            self.requests += 1
+
+    def _image(self, album, index):
+        if index >= self.images - SHARED_IMAGES:
+            album = -1
+        key = (album, index)
+        if key not in self._image_cache:
+            self._image_cache[key] = _fixture_image(album, index)
+        return self._image_cache[key]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type="text/html; charset=utf-8", status=200, headers=None):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                server._count(len(body))
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == f"/categories/{CATEGORY_ID}":
+                    return self._send(_category_page(server.base, server.albums))
+                m = re.fullmatch(r"/albums/(\d+)", path)
+                if m:
+                    return self._send(_album_page(server.base, int(m.group(1)), server.images))
+                m = re.fullmatch(r"/photos/(\d+)/(\d+)\.jpg", path)
+                if m:
+                    etag = f'"{m.group(1)}-{m.group(2)}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(b"", status=304, headers={"ETag": etag})
+                    return self._send(server._image(int(m.group(1)), int(m.group(2))), "image/jpeg",
+                                      headers={"ETag": etag})
+                m = re.fullmatch(r"/brand/(\d+)", path)
+                if m:
+                    return self._send(_brand_page(int(m.group(1))))
+                if path == "/admin/products/new":
+                    return self._send(ADMIN_FORM)
+                m = re.fullmatch(r"/admin/products/(\d+)", path)
+                if m:
+                    return self._send(f"<html><body>Product {m.group(1)} saved</body></html>")
+                self._send("not found", status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if self.path.endswith("/chat/completions"):
+                    # Stub of the chat-completions endpoint, answering after a fixed model latency
+                    time.sleep(LLM_LATENCY)
+                    prompt = json.loads(body)["messages"][-1]["content"]
+                    name = re.search(r"Original Product Name: (.*)", prompt).group(1)
+                    return self._send(json.dumps(_completion(f"{name} Tote\nA structured everyday tote.")),
+                                      "application/json")
+                if self.path.startswith("/admin/api/"):
+                    return self._send(json.dumps(server._graphql(json.loads(body))), "application/json")
+                if self.path.startswith("/staged/"):
+                    return self._send(b"", status=201)
+                if self.path.startswith("/admin/products"):
+                    with server._lock:
+                        server.products += 1
+                        product_id = server.products
+                    self.send_response(302)
+                    self.send_header("Location", f"/admin/products/{product_id}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self._send("not found", status=404)
+
+        return Handler
+
+    def _spend(self, cost):
+        """Leaky bucket like Shopify's; returns (allowed, throttleStatus)."""
+        maximum, restore = API_BUCKET
+        with self._lock:
+            now = time.monotonic()
+            self.api_points = min(maximum, self.api_points + (now - self.api_updated) * restore)
+            self.api_updated = now
+            allowed = self.api_points >= cost
+            if allowed:
+                self.api_points -= cost
+            status = {"maximumAvailable": maximum, "currentlyAvailable": int(self.api_points), "restoreRate": restore}
+        return allowed, status
+
+    def _graphql(self, request):
+        """Mock of the Admin API mutations the API uploader sends, with cost-based throttling."""
+        time.sleep(API_LATENCY)
+        cost = 10
+        allowed, status = self._spend(cost)
+        extensions = {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost if allowed else None,
+                               "throttleStatus": status}}
+        if not allowed:
+            return {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                    "extensions": extensions}
+        response = self._graphql_data(request)
+        response["extensions"] = extensions
+        return response
+
+    def _graphql_data(self, request):
+        query, variables = request["query"], request.get("variables") or {}
+        if "stagedUploadsCreate" in query:
+            with self._lock:
+                first = self.staged
+                self.staged += len(variables["input"])
+            targets = [{"url": f"{self.base}/staged/{first + i}", "resourceUrl": f"{self.base}/staged/{first + i}",
+                        "parameters": [{"name": "key", "value": f"tmp/{first + i}/{spec['filename']}"}]}
+                       for i, spec in enumerate(variables["input"])]
+            return {"data": {"stagedUploadsCreate": {"stagedTargets": targets, "userErrors": []}}}
+        if "productCreate" in query:
+            with self._lock:
+                self.api_products += 1
+                n = self.api_products
+                first = self.media
+                self.media += len(variables.get("media") or [])
+            product = {"id": f"gid://shopify/Product/{n}", "variants": {"nodes": [
+                {"id": f"gid://shopify/ProductVariant/{n}", "inventoryItem": {"id": f"gid://shopify/InventoryItem/{n}"}}]},
+                "media": {"nodes": [{"id": f"gid://shopify/MediaImage/{first + i}"}
+                                    for i in range(len(variables.get("media") or []))]}}
+            return {"data": {"productCreate": {"product": product, "userErrors": []}}}
+        if "nodes(ids:" in query:
+            return {"data": {"nodes": [{"id": media_id, "fileStatus": "READY"} for media_id in variables["ids"]]}}
+        if "fileUpdate" in query:
+            with self._lock:
+                self.media_refs += len(variables["files"])
+            return {"data": {"fileUpdate": {"files": [{"id": f["id"]} for f in variables["files"]],
+                                            "userErrors": []}}}
+        operation = re.search(r"mutation (\w+)", query).group(1)
+        return {"data": {operation: {"userErrors": []}}}
+
+    def start(self):
+        # Render every photo up front so image encoding is not billed to the download stage
+        for album in range(self.albums):
+            for index in range(self.images):
+                self._image(album, index)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Timings:
+    """Collects per-stage wall-clock latencies from wrapped functions."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.samples[stage].append(time.perf_counter() - started)
+        return timed
+
+    def summary(self):
+        return {stage: {"count": len(v), "p50": percentile(v, 50), "p95": percentile(v, 95),
+                        "p99": percentile(v, 99), "total": sum(v)}
+                for stage, v in sorted(self.samples.items())}
+
+
+def bench_crawl(server, workdir, timings, workers):
+    """Crawl the fixture category with the scraper's HTTP path and download + preprocess every album."""
+    import scraper
+    import downloader
+    import image_preprocess
+    from crawl_index import CrawlIndex
+    from image_store import ImageStore
+    from driver_pool import DriverPool
+
+    scraper.BASE_URL = server.base
+    scraper.CRAWL_MODE = "http"
+    scraper.BASE_DOWNLOAD_DIR = os.path.join(workdir, "downloads")
+    image_preprocess.DERIVED_DIR = os.path.join(workdir, "derived")
+    for name in ("fetch_page", "download_images"):
+        setattr(scraper, name, timings.wrap(name, getattr(scraper, name)))
+    process_album = timings.wrap("album", scraper.process_album)
+    preprocess = timings.wrap("preprocess", image_preprocess.album_derivatives)
+
+    session = downloader.build_session(scraper.HEADERS, pool_size=downloader.MAX_WORKERS * workers)
+    index = CrawlIndex(os.path.join(workdir, "crawl_index.sqlite"))
+    store = ImageStore(os.path.join(workdir, "store"))
+    pool = DriverPool(scraper.chrome_options, size=1)
+    processes = ProcessPoolExecutor(max_workers=image_preprocess.WORKERS)
+    try:
+        category, albums = timings.wrap("list_albums", scraper.list_albums)(
+            f"/categories/{CATEGORY_ID}", session, pool)
+
+        def run(album):
+            album_path, _ = process_album(album, category, f"/categories/{CATEGORY_ID}", session, index, store, pool)
+            preprocess(album_path, processes)
+            return album_path
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            album_paths = list(executor.map(run, albums))
+    finally:
+        processes.shutdown()
+        pool.close()
+        index.close()
+        store.close()
+    return album_paths
+
+
+def bench_extract_http(server, timings):
+    """Run the concurrent HTTP candidate extraction over the brand fixtures, TOP_N pages per batch."""
+    import page_extractor
+    import image_search_description_generator as enricher
+
+    page_extractor.fetch_and_extract = timings.wrap("extract_http", page_extractor.fetch_and_extract)
+    batch = timings.wrap("extract_candidates", page_extractor.extract_candidates)
+    score = timings.wrap("score_link", enricher.score_link)
+    urls = [f"{server.base}/brand/{page}" for page in range(server.brand_pages)]
+    found = 0
+    for start in range(0, len(urls), page_extractor.TOP_N):
+        best, _ = batch(urls[start:start + page_extractor.TOP_N], score)
+        found += bool(best)
+    return found
+
+
+def bench_rewrite(server, workdir, timings, albums):
+    """Rewrite every album through the stub endpoint twice: cold, then answered from the response cache."""
+    from llm_rewriter import Rewriter, ResponseCache
+
+    rewriter = Rewriter(cache=ResponseCache(os.path.join(workdir, "llm_cache.sqlite")), base_url=f"{server.base}/v1",
+                        rpm=6000, tpm=10 ** 7)
+    for stage in ("rewrite_cold", "rewrite_cached"):
+        rewrite = timings.wrap(stage, rewriter.rewrite)
+        futures = [rewriter.executor.submit(rewrite, "Material: calfskin", f"Fixture Bag {k}", "A tote.", "Bag")
+                   for k in range(albums)]
+        for future in futures:
+            future.result()
+    stats = dict(rewriter.stats)
+    rewriter.close()
+    return stats
+
+
+def bench_api_upload(server, workdir, album_paths, timings, workers):
+    """Create a product per album through the Admin API mock, with staged media uploads, concurrently."""
+    import shopify_api
+    from catalog import Catalog
+    from upload_ledger import UploadLedger
+    from media_registry import MediaRegistry
+
+    if not album_paths:
+        return None
+    folder = os.path.dirname(album_paths[0])
+    catalog = Catalog(folder)
+    ledger = UploadLedger(folder)
+    registry = MediaRegistry("fixture", os.path.join(workdir, "media_registry.sqlite"))
+    api = shopify_api.AdminAPI(api_url=f"{server.base}/admin/api/{shopify_api.API_VERSION}/graphql.json",
+                               registry=registry)
+    shopify_api.upload_album = timings.wrap("api_upload_album", shopify_api.upload_album)
+    try:
+        for album_path in album_paths:
+            catalog.save_found(album_path, "Fixture", f"Tote {os.path.basename(album_path)}",
+                               "A structured everyday tote.\nGrained calfskin.", 300, os.listdir(album_path))
+            catalog.save_rewrite(album_path, f"Tote {os.path.basename(album_path)}", "A structured everyday tote.")
+        staged_before = server.staged
+        report = shopify_api.upload_all(api, catalog, ledger, folder, workers)
+        report["images_staged"] = server.staged - staged_before
+        report["media_reused"] = server.media_refs
+        # A second pass over the unchanged albums should only hash and skip
+        started = time.perf_counter()
+        report["resync_todo"] = len(shopify_api.albums_to_upload(ledger, catalog, folder))
+        report["resync_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+    finally:
+        ledger.close()
+        catalog.close()
+        registry.close()
+
+
+def bench_browser(server, album_paths, timings):
+    """Run extract_product_details (snapshot and per-element modes) and the Selenium uploader against the fixtures in headless Chrome."""
+    import image_search_description_generator as enricher
+    import shopify_uploader
+    from driver_pool import DriverPool
+
+    extract = timings.wrap("extract_product_details", enricher.extract_product_details)
+    extract_elements = timings.wrap("extract_elements", enricher.extract_product_details_elements)
+    upload = timings.wrap("upload_album", shopify_uploader.upload_album)
+    shopify_uploader.NEW_PRODUCT_URL = f"{server.base}/admin/products/new"
+    from catalog import Catalog
+
+    pool = DriverPool(enricher.chrome_options, size=1)
+    catalog = Catalog(os.path.dirname(album_paths[0])) if album_paths else None
+    try:
+        with pool.driver() as driver:
+            for page in range(min(10, server.brand_pages)):
+                driver.get(f"{server.base}/brand/{page}")
+                extract(driver)
+                extract_elements(driver)
+            for album_path in album_paths[:10]:
+                enricher.save_product_details(catalog, album_path, "Fixture", f"Tote {os.path.basename(album_path)}",
+                                              "A structured everyday tote.", 300, os.listdir(album_path))
+                upload(driver, album_path, catalog)
+    finally:
+        pool.close()
+        if catalog is not None:
+            catalog.close()
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """Return human-readable regressions of report against a baseline report."""
+    regressions = []
+    old, new = baseline.get("albums_per_minute"), report.get("albums_per_minute")
+    if old and new and new < old * (1 - threshold):
+        regressions.append(f"albums_per_minute {new:.1f} < baseline {old:.1f}")
+    for stage, stats in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95")
+        if before and stats["p95"] and stats["p95"] > before * (1 + threshold):
+            regressions.append(f"{stage} p95 {stats['p95'] * 1000:.1f}ms > baseline {before * 1000:.1f}ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against local fixtures.")
+    parser.add_argument("--albums", type=int, default=ALBUMS)
+    parser.add_argument("--images", type=int, default=IMAGES_PER_ALBUM)
+    parser.add_argument("--workers", type=int, default=4, help="albums crawled in parallel")
+    parser.add_argument("--upload-workers", type=int, default=8, help="concurrent Admin API uploads")
+    parser.add_argument("--browser", action="store_true", help="also run Selenium extraction and upload")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--baseline", help="report to compare against; exits 1 on regression")
+    args = parser.parse_args(argv)
+
+    from rate_limiter import LIMITER
+    # Measure the code, not the politeness settings meant for live hosts
+    LIMITER.limits["127.0.0.1"] = (10000.0, 10000, 1.0, 10000.0)
+
+    server = FixtureServer(args.albums, args.images).start()
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    # Keep the run trace and Prometheus file of the instrumented code out of the real downloads folder
+    METRICS.trace_dir = os.path.join(workdir, "_runs")
+    METRICS.prom_file = os.path.join(workdir, "_runs", "pipeline.prom")
+    timings = Timings()
+    try:
+        started = time.perf_counter()
+        album_paths = bench_crawl(server, workdir, timings, args.workers)
+        crawl_seconds = time.perf_counter() - started
+        found = bench_extract_http(server, timings)
+        rewrites = bench_rewrite(server, workdir, timings, len(album_paths))
+        api_upload = bench_api_upload(server, workdir, album_paths, timings, args.upload_workers)
+        if args.browser:
+            bench_browser(server, album_paths, timings)
+    finally:
+        server.stop()
+        METRICS.finish()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "albums": len(album_paths),
+        "crawl_seconds": round(crawl_seconds, 3),
+        "albums_per_minute": round(len(album_paths) / crawl_seconds * 60, 1) if crawl_seconds else None,
+        "candidate_batches_resolved": found,
+        "rewrites": rewrites,
+        "api_upload": api_upload,
+        "bytes_transferred": server.bytes_sent,
+        "requests": server.requests,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timings.summary(),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[✓] {report['albums']} albums in {report['crawl_seconds']}s "
+          f"({report['albums_per_minute']} albums/min), {report['bytes_transferred'] / 1e6:.1f} MB "
+          f"over {report['requests']} requests, peak RSS {report['peak_rss_mb']} MB")
+    for stage, stats in report["stages"].items():
+        print(f"    {stage:<24} n={stats['count']:<5} p50={stats['p50'] * 1000:8.1f}ms "
+              f"p95={stats['p95'] * 1000:8.1f}ms p99={stats['p99'] * 1000:8.1f}ms")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        for line in regressions:
+            print(f"[!] Regression: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
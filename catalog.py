@@ -0,0 +1,175 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+
+from db import locked
+
+CATALOG_FILE = "catalog.sqlite"    # One per category folder, next to the album folders
+LEGACY_DETAILS_FILE = "product_details.txt"
+
+# Album lifecycle: found (raw details) -> rewritten (LLM copy) -> uploaded
+FOUND, REWRITTEN, UPLOADED = "found", "rewritten", "uploaded"
+
+# Upsert condition for raw details that invalidate the rewrite; a price change alone does not
+DETAILS_CHANGED = ("(brand IS NOT excluded.brand OR raw_name IS NOT excluded.raw_name "
+                   "OR raw_description IS NOT excluded.raw_description OR images IS NOT excluded.images)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    album TEXT PRIMARY KEY,
+    brand TEXT,
+    name TEXT,
+    description TEXT,
+    raw_name TEXT,
+    raw_description TEXT,
+    price REAL,
+    images TEXT,
+    status TEXT,
+    created_at REAL,
+    updated_at REAL,
+    uploaded_at REAL
+);
+CREATE INDEX IF NOT EXISTS products_by_status ON products (status, album);
+"""
+
+
+def parse_details_file(path):
+    """Read a legacy product_details.txt, keeping descriptions that span several lines."""
+    fields = {"Brand": "", "Product Name": "", "Description": "", "Price": ""}
+    current = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            key, sep, value = line.partition(":")
+            if sep and key in fields:
+                current = key
+                fields[key] = value.strip()
+            elif current == "Description":
+                fields["Description"] += "\n" + line.rstrip("\n")
+    price = fields["Price"].lstrip("$").strip()
+    return {"brand": fields["Brand"], "name": fields["Product Name"],
+            "description": fields["Description"].strip(), "price": float(price) if price else None}
+
+
+def format_details(product):
+    """The product as the plain-text block the rewrite prompt uses for context.
+
+    The price is left out: the copy never mentions it, and it would split the rewrite cache.
+    """
+    return (f"Brand: {product['brand']}\n"
+            f"Product Name: {product['name']}\n"
+            f"Description: {product['description']}\n")
+
+
+class Catalog:
+    """Typed product records for every album of one category folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(folder, CATALOG_FILE), check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        product = dict(row)
+        product["images"] = json.loads(product["images"]) if product["images"] else []
+        return product
+
+    @locked
+    def product(self, album_path):
+        row = self.conn.execute("SELECT * FROM products WHERE album = ?", (os.path.basename(album_path),)).fetchone()
+        return self._row(row)
+
+    @locked
+    def products(self, status=None):
+        """Every product (or every product in one status), ordered by album folder name."""
+        if status is None:
+            rows = self.conn.execute("SELECT * FROM products ORDER BY album")
+        else:
+            rows = self.conn.execute("SELECT * FROM products WHERE status = ? ORDER BY album", (status,))
+        return [self._row(r) for r in rows]
+
+    @locked
+    def save_found(self, album_path, brand, name, description, price, images):
+        """Record the raw details found for an album; a later rewrite replaces name and description.
+
+        Finding the same details again keeps the rewritten copy and status, so the album is not re-uploaded;
+        a price change alone is stored without resetting them.
+        """
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO products (album, brand, name, description, raw_name, raw_description, price, images, "
+            "status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(album) DO UPDATE SET "
+            f"name = CASE WHEN {DETAILS_CHANGED} THEN excluded.name ELSE name END, "
+            f"description = CASE WHEN {DETAILS_CHANGED} THEN excluded.description ELSE description END, "
+            f"status = CASE WHEN {DETAILS_CHANGED} THEN excluded.status ELSE status END, "
+            "brand = excluded.brand, raw_name = excluded.raw_name, raw_description = excluded.raw_description, "
+            "price = excluded.price, images = excluded.images, updated_at = excluded.updated_at",
+            (os.path.basename(album_path), brand, name, description, name, description, price,
+             json.dumps(sorted(images)), FOUND, now, now))
+        self.conn.commit()
+
+    @locked
+    def save_rewrite(self, album_path, name, description):
+        self.conn.execute("UPDATE products SET name = ?, description = ?, status = ?, updated_at = ? WHERE album = ?",
+                          (name, description, REWRITTEN, time.time(), os.path.basename(album_path)))
+        self.conn.commit()
+
+    @locked
+    def mark_uploaded(self, album_path):
+        now = time.time()
+        self.conn.execute("UPDATE products SET status = ?, updated_at = ?, uploaded_at = ? WHERE album = ?",
+                          (UPLOADED, now, now, os.path.basename(album_path)))
+        self.conn.commit()
+
+    @locked
+    def import_legacy(self):
+        """Bring product_details.txt files from earlier runs into the catalog, once. Returns how many."""
+        known = {r["album"] for r in self.conn.execute("SELECT album FROM products")}
+        imported = 0
+        for album in os.listdir(self.folder):
+            details_file = os.path.join(self.folder, album, LEGACY_DETAILS_FILE)
+            if album in known or not os.path.isfile(details_file):
+                continue
+            details = parse_details_file(details_file)
+            now = time.time()
+            self.conn.execute(
+                "INSERT INTO products (album, brand, name, description, price, images, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (album, details["brand"], details["name"], details["description"], details["price"],
+                 json.dumps([]), REWRITTEN, now, now))
+            imported += 1
+        self.conn.commit()
+        return imported
+
+    @locked
+    def close(self):
+        self.conn.close()
+
+
+class CatalogSet:
+    """Opens each category's catalog once and hands it out by album path."""
+
+    def __init__(self):
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    def for_album(self, album_path):
+        folder = os.path.dirname(os.path.abspath(album_path))
+        with self.lock:
+            if folder not in self.catalogs:
+                self.catalogs[folder] = Catalog(folder)
+            return self.catalogs[folder]
+
+    def close(self):
+        with self.lock:
+            for catalog in self.catalogs.values():
+                catalog.close()
+            self.catalogs.clear()
@@ -0,0 +1,249 @@
+"""Single entry point for the pipeline: crawl, enrich, upload, or run everything as one stream.
+
+    python cli.py --config chanel.json enrich
+    python cli.py crawl --category /categories/2994023 --download-dir downloads/Prada_Bags
+    python cli.py --dry-run upload --folder downloads/Prada_Bags
+    python cli.py queue seed && python cli.py worker --stage enrich --stage rewrite
+
+Only the modules a command needs are imported, so --help and --dry-run never load
+selenium, requests or openai, and one invocation per brand can run side by side.
+"""
+import os
+import sys
+import json
+import argparse
+import importlib
+
+ENRICHER = "image_search_description_generator"
+
+# Config key -> module attributes it overrides; keys are the same in the config file and on the command line
+SETTINGS = {
+    "base_url": [("scraper", "BASE_URL")],
+    "categories": [("scraper", "TARGET_CATEGORIES")],
+    "download_dir": [("scraper", "BASE_DOWNLOAD_DIR")],
+    "crawl_mode": [("scraper", "CRAWL_MODE")],
+    "folder": [(ENRICHER, "TARGET_FOLDER"), ("shopify_uploader", "ROOT_FOLDER"), ("shopify_api", "ROOT_FOLDER")],
+    "brand": [(ENRICHER, "BRAND_NAME")],
+    "brand_domains": [(ENRICHER, "BRAND_DOMAINS")],
+    "product_category": [(ENRICHER, "PRODUCT_CATEGORY")],
+    "headless": [(ENRICHER, "HEADLESS")],
+    "openai_api_key": [("llm_rewriter", "API_KEY")],
+    "shop_domain": [("shopify_api", "SHOP_DOMAIN")],
+    "access_token": [("shopify_api", "ACCESS_TOKEN")],
+    "new_product_url": [("shopify_uploader", "NEW_PRODUCT_URL")],
+    "upload_mode": [("pipeline", "UPLOAD_MODE")],
+    "upload": [("pipeline", "UPLOAD")],
+    "queue_path": [("work_queue", "QUEUE_PATH")],
+}
+SECRETS = {"openai_api_key", "access_token"}
+# Secrets can come from the environment instead of a config file
+ENVIRONMENT = {"openai_api_key": "OPENAI_API_KEY", "access_token": "SHOPIFY_ACCESS_TOKEN"}
+
+# Modules each command runs with; settings for other modules are ignored
+COMMAND_MODULES = {
+    "crawl": ["scraper"],
+    "enrich": [ENRICHER, "llm_rewriter"],
+    "upload": ["shopify_api"],
+    "upload-browser": ["shopify_api", "shopify_uploader"],
+    "run": ["scraper", ENRICHER, "llm_rewriter", "shopify_api", "shopify_uploader", "pipeline"],
+    "worker": ["scraper", ENRICHER, "llm_rewriter", "shopify_api", "shopify_uploader", "work_queue", "pipeline"],
+    "queue": ["work_queue"],
+    "queue-seed": ["scraper", "work_queue", "pipeline"],
+}
+
+
+def load_config(path):
+    """Settings from a JSON file; unknown keys are an error so typos do not silently fall back to defaults."""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    unknown = sorted(set(config) - set(SETTINGS))
+    if unknown:
+        raise SystemExit(f"[!] Unknown settings in {path}: {', '.join(unknown)}")
+    return config
+
+
+def resolve_config(args):
+    """Environment secrets, overridden by the config file, overridden by any flag given on the command line."""
+    config = {key: os.environ[var] for key, var in ENVIRONMENT.items() if os.environ.get(var)}
+    config.update(load_config(getattr(args, "config", None)))
+    for key in SETTINGS:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    return config
+
+
+def apply_config(config, modules):
+    """Import the given modules and set their module-level config from the resolved settings."""
+    loaded = {name: importlib.import_module(name) for name in modules}
+    for key, value in config.items():
+        for module_name, attr in SETTINGS[key]:
+            if module_name in loaded:
+                setattr(loaded[module_name], attr, value)
+    # Values derived from the settings at import time
+    if "scraper" in loaded and "base_url" in config:
+        loaded["scraper"].HEADERS["Referer"] = config["base_url"].rstrip("/") + "/"
+    if ENRICHER in loaded and "brand_domains" in config:
+        loaded[ENRICHER].BRAND_HOSTS = loaded[ENRICHER].DomainMatcher(config["brand_domains"])
+    return loaded
+
+
+def album_count(folder):
+    if not folder or not os.path.isdir(folder):
+        return None
+    return sum(1 for entry in os.scandir(folder) if entry.is_dir())
+
+
+def command_modules(command, config, action=None):
+    if command == "upload" and config.get("upload_mode") == "browser":
+        return COMMAND_MODULES["upload-browser"]
+    if command == "queue" and action == "seed":
+        return COMMAND_MODULES["queue-seed"]
+    return COMMAND_MODULES[command]
+
+
+def dry_run(command, config, action=None):
+    """Print what a command would run with, without importing or touching anything else."""
+    shown = {key: ("***" if key in SECRETS else value) for key, value in sorted(config.items())}
+    print(f"🧪 Dry run: {command}")
+    print(f"   Modules: {', '.join(command_modules(command, config, action))}")
+    print("   Settings (others keep the module defaults):")
+    for key, value in shown.items():
+        print(f"     {key} = {json.dumps(value)}")
+    for key in ("folder", "download_dir"):
+        if key in config:
+            count = album_count(config[key])
+            print(f"   {key}: " + (f"{count} album folders" if count is not None else "does not exist yet"))
+    return 0
+
+
+def cmd_crawl(config, args):
+    scraper = apply_config(config, COMMAND_MODULES["crawl"])["scraper"]
+    scraper.main()
+
+
+def cmd_enrich(config, args):
+    enricher = apply_config(config, COMMAND_MODULES["enrich"])[ENRICHER]
+    enricher.process_single_folder(enricher.TARGET_FOLDER)
+
+
+def cmd_upload(config, args):
+    loaded = apply_config(config, command_modules("upload", config))
+    uploader = loaded.get("shopify_uploader") or loaded["shopify_api"]
+    uploader.main(uploader.ROOT_FOLDER)
+
+
+def cmd_run(config, args):
+    pipeline = apply_config(config, COMMAND_MODULES["run"])["pipeline"]
+    pipeline.main()
+
+
+def cmd_worker(config, args):
+    pipeline = apply_config(config, COMMAND_MODULES["worker"])["pipeline"]
+    pipeline.run_workers(args.stages, drain=args.drain)
+
+
+def cmd_queue(config, args):
+    loaded = apply_config(config, command_modules("queue", config, args.action))
+    work_queue = loaded["work_queue"]
+    queue = work_queue.WorkQueue(work_queue.QUEUE_PATH)
+    try:
+        if args.action == "seed":
+            queued = loaded["pipeline"].seed_queue(queue)
+            print(f"[✓] Queued {queued} category crawls")
+        elif args.action == "dead":
+            for job in queue.dead_letters(args.stage):
+                print(f"{job['stage']:<9} {job['key']}  ({job['attempts']} attempts) {job['last_error']}")
+        elif args.action == "requeue":
+            print(f"[✓] Requeued {queue.requeue_dead(args.stage)} dead jobs")
+        for stage, counts in sorted(queue.counts().items()):
+            print(f"[✓] {stage}: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    finally:
+        queue.close()
+
+
+COMMANDS = {"crawl": cmd_crawl, "enrich": cmd_enrich, "upload": cmd_upload, "run": cmd_run,
+            "worker": cmd_worker, "queue": cmd_queue}
+
+
+def add_crawl_flags(parser):
+    parser.add_argument("--base-url", dest="base_url", help="Yupoo store URL")
+    parser.add_argument("--category", dest="categories", action="append", metavar="PATH",
+                        help="category path such as /categories/2994023 (repeatable)")
+    parser.add_argument("--download-dir", dest="download_dir")
+    parser.add_argument("--crawl-mode", dest="crawl_mode", choices=["http", "browser"])
+
+
+def add_enrich_flags(parser, folder=True):
+    if folder:
+        parser.add_argument("--folder", help="category folder of album folders")
+    parser.add_argument("--brand")
+    parser.add_argument("--brand-domain", dest="brand_domains", action="append", metavar="DOMAIN",
+                        help="official brand site, e.g. chanel.com (repeatable)")
+    parser.add_argument("--product-category", dest="product_category")
+    parser.add_argument("--show-browser", dest="headless", action="store_const", const=False, default=None,
+                        help="run the Lens browsers visibly")
+
+
+def add_upload_flags(parser, folder=True):
+    if folder:
+        parser.add_argument("--folder", help="category folder of album folders")
+    parser.add_argument("--mode", dest="upload_mode", choices=["api", "browser"])
+    parser.add_argument("--shop", dest="shop_domain", help="shop domain, e.g. example.myshopify.com")
+
+
+def build_parser():
+    # Accepted before or after the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", default=argparse.SUPPRESS, help="JSON file of settings; flags override it")
+    common.add_argument("--dry-run", action="store_true", default=argparse.SUPPRESS,
+                        help="show the resolved settings and exit")
+
+    parser = argparse.ArgumentParser(description="Yupoo to Shopify product pipeline.", parents=[common])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_crawl_flags(commands.add_parser("crawl", parents=[common], help="download category albums"))
+    add_enrich_flags(commands.add_parser("enrich", parents=[common],
+                                         help="find and rewrite product details for a folder"))
+    add_upload_flags(commands.add_parser("upload", parents=[common],
+                                         help="create Shopify products from a folder's catalog"))
+
+    run = commands.add_parser("run", parents=[common],
+                              help="crawl, enrich, rewrite and upload as one streaming pipeline")
+    add_crawl_flags(run)
+    add_enrich_flags(run, folder=False)
+    add_upload_flags(run, folder=False)
+    run.add_argument("--no-upload", dest="upload", action="store_const", const=False, default=None,
+                     help="stop after the rewrite stage")
+
+    # Several worker processes on one machine share one queue file on its local disk
+    worker = commands.add_parser("worker", parents=[common], help="serve jobs from the shared work queue")
+    add_enrich_flags(worker, folder=False)
+    add_upload_flags(worker, folder=False)
+    worker.add_argument("--stage", dest="stages", action="append",
+                        choices=["crawl", "download", "enrich", "rewrite", "upload"],
+                        help="stage to serve (repeatable; default all)")
+    worker.add_argument("--drain", action="store_true", help="exit once the queue has no work left")
+    worker.add_argument("--queue", dest="queue_path", help="work queue SQLite file")
+
+    queue = commands.add_parser("queue", parents=[common], help="seed or inspect the shared work queue")
+    queue.add_argument("action", choices=["status", "seed", "dead", "requeue"])
+    add_crawl_flags(queue)
+    queue.add_argument("--stage", help="limit dead/requeue to one stage")
+    queue.add_argument("--queue", dest="queue_path", help="work queue SQLite file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = resolve_config(args)
+    if getattr(args, "dry_run", False):
+        return dry_run(args.command, config, getattr(args, "action", None))
+    COMMANDS[args.command](config, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
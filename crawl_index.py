@@ -0,0 +1,191 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from db import locked
+
+INDEX_PATH = "downloads/crawl_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    album_url TEXT PRIMARY KEY,
+    category_url TEXT,
+    category_name TEXT,
+    title TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    images_hash TEXT,
+    status TEXT,
+    last_seen_run INTEGER
+);
+CREATE INDEX IF NOT EXISTS albums_by_category ON albums (category_url, last_seen_run);
+CREATE TABLE IF NOT EXISTS images (
+    image_url TEXT PRIMARY KEY,
+    album_url TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT,
+    local_path TEXT,
+    last_seen_run INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_by_album ON images (album_url);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL,
+    finished_at REAL,
+    report TEXT
+);
+"""
+
+
+def conditional_headers(row):
+    """Build If-None-Match / If-Modified-Since headers from a stored row."""
+    headers = {}
+    if row and row.get("etag"):
+        headers["If-None-Match"] = row["etag"]
+    if row and row.get("last_modified"):
+        headers["If-Modified-Since"] = row["last_modified"]
+    return headers
+
+
+def images_hash(image_urls):
+    """Stable fingerprint of an album's image URL list."""
+    return hashlib.sha256("\n".join(image_urls).encode()).hexdigest()
+
+
+class CrawlIndex:
+    """Persistent record of crawled categories, albums and images used for incremental re-crawls."""
+
+    def __init__(self, db_path=INDEX_PATH):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        cur = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),))
+        self.run_id = cur.lastrowid
+        self.conn.commit()
+        self.report = {
+            "albums": {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0},
+            "images": {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0},
+        }
+
+    @locked
+    def album(self, album_url):
+        row = self.conn.execute("SELECT * FROM albums WHERE album_url = ?", (album_url,)).fetchone()
+        return dict(row) if row else None
+
+    @locked
+    def image(self, image_url):
+        row = self.conn.execute("SELECT * FROM images WHERE image_url = ?", (image_url,)).fetchone()
+        return dict(row) if row else None
+
+    @locked
+    def album_images(self, album_url):
+        rows = self.conn.execute("SELECT * FROM images WHERE album_url = ?", (album_url,)).fetchall()
+        return [dict(r) for r in rows]
+
+    @locked
+    def album_files_present(self, album_url, image_urls=None):
+        """True if every indexed image of the album (and every URL in image_urls) exists on disk."""
+        images = self.album_images(album_url)
+        if image_urls is not None and set(image_urls) - {img["image_url"] for img in images}:
+            return False
+        return bool(images) and all(img["local_path"] and os.path.exists(img["local_path"]) for img in images)
+
+    @locked
+    def touch_album(self, album_url):
+        """Mark an album and its images as seen this run without changes (e.g. after a 304)."""
+        self.conn.execute("UPDATE albums SET last_seen_run = ?, status = 'unchanged' WHERE album_url = ?",
+                          (self.run_id, album_url))
+        self.conn.execute("UPDATE images SET last_seen_run = ? WHERE album_url = ?", (self.run_id, album_url))
+        self.conn.commit()
+        self.report["albums"]["unchanged"] += 1
+
+    @locked
+    def record_album(self, category_url, category_name, album_url, title, image_urls, etag=None, last_modified=None):
+        """Store the album's current state and return 'new', 'changed' or 'unchanged'.
+
+        The ETag/Last-Modified are only kept for an unchanged album; otherwise they are stored with
+        set_validators once every image is on disk, so a 304 never skips a partly downloaded album.
+        """
+        previous = self.album(album_url)
+        fingerprint = images_hash(image_urls)
+        if previous is None:
+            status = "new"
+        elif previous["images_hash"] == fingerprint and self.album_files_present(album_url, image_urls):
+            status = "unchanged"
+        else:
+            status = "changed"
+        if status != "unchanged":
+            etag, last_modified = None, None
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO albums (album_url, category_url, category_name, title, etag, last_modified,"
+            " images_hash, status, last_seen_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (album_url, category_url, category_name, title, etag, last_modified, fingerprint, status, self.run_id))
+        if previous is not None:
+            gone = [img["image_url"] for img in self.album_images(album_url) if img["image_url"] not in image_urls]
+            for image_url in gone:
+                self.conn.execute("DELETE FROM images WHERE image_url = ?", (image_url,))
+            self.report["images"]["deleted"] += len(gone)
+        if status == "unchanged":
+            self.conn.execute("UPDATE images SET last_seen_run = ? WHERE album_url = ?", (self.run_id, album_url))
+        self.conn.commit()
+        self.report["albums"][status] += 1
+        return status
+
+    @locked
+    def set_validators(self, album_url, etag, last_modified):
+        """Store the album page's ETag/Last-Modified after all of its images were downloaded."""
+        self.conn.execute("UPDATE albums SET etag = ?, last_modified = ? WHERE album_url = ?",
+                          (etag, last_modified, album_url))
+        self.conn.commit()
+
+    @locked
+    def record_image(self, album_url, result):
+        """Store a downloader result for an album image."""
+        previous = self.image(result["url"])
+        if result.get("not_modified"):
+            self.conn.execute("UPDATE images SET last_seen_run = ?, album_url = ? WHERE image_url = ?",
+                              (self.run_id, album_url, result["url"]))
+            self.report["images"]["unchanged"] += 1
+        else:
+            if previous is None:
+                self.report["images"]["new"] += 1
+            elif previous["sha256"] != result["sha256"]:
+                self.report["images"]["changed"] += 1
+            else:
+                self.report["images"]["unchanged"] += 1
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (image_url, album_url, etag, last_modified, sha256, local_path,"
+                " last_seen_run) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (result["url"], album_url, result.get("etag"), result.get("last_modified"),
+                 result["sha256"], result["path"], self.run_id))
+        self.conn.commit()
+
+    @locked
+    def sweep_deleted(self, category_url):
+        """Mark albums of a category that were not seen this run as deleted and return their URLs."""
+        rows = self.conn.execute(
+            "SELECT album_url FROM albums WHERE category_url = ? AND last_seen_run < ? AND status != 'deleted'",
+            (category_url, self.run_id)).fetchall()
+        deleted = [r["album_url"] for r in rows]
+        for album_url in deleted:
+            self.conn.execute("UPDATE albums SET status = 'deleted' WHERE album_url = ?", (album_url,))
+        self.conn.commit()
+        self.report["albums"]["deleted"] += len(deleted)
+        return deleted
+
+    @locked
+    def close(self):
+        self.conn.execute("UPDATE runs SET finished_at = ?, report = ? WHERE run_id = ?",
+                          (time.time(), json.dumps(self.report), self.run_id))
+        self.conn.commit()
+        self.conn.close()
+        logging.info(f"Crawl report: {self.report}")
@@ -0,0 +1,14 @@
+import functools
+
+
+def locked(method):
+    """Run a method while holding self.lock.
+
+    The SQLite-backed stores open one connection with check_same_thread=False and share it
+    between worker threads; the lock keeps their statements and commits from interleaving.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,105 @@
+import os
+import time
+import sqlite3
+import threading
+
+from rate_limiter import host_of
+
+# ========== CONFIG ==========
+DOMAIN_STATS_PATH = "downloads/domain_stats.sqlite"
+PRIOR_SUCCESS = 0.3     # Success rate assumed for a domain we have never tried
+PRIOR_WEIGHT = 4        # How many attempts the prior is worth
+SUCCESS_WEIGHT = 12     # Score points between a domain that always fails and one that always works
+BLOCK_PENALTY = 6       # Score points taken off a domain that always blocks us
+SLOW_SECONDS = 8.0      # Average extraction time at which the latency penalty reaches 1 point
+# ============================
+
+
+class DomainMatcher:
+    """Host patterns compiled into set lookups.
+
+    "pinterest." and "farfetch" match a host label, ".kr" and "chanel.com" match a host suffix,
+    so a check costs one lookup per label instead of one substring scan per pattern.
+    """
+
+    def __init__(self, patterns):
+        self.labels = set()
+        self.suffixes = set()
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if pattern.endswith(".") or "." not in pattern:
+                self.labels.add(pattern.rstrip("."))
+            else:
+                self.suffixes.add(pattern.lstrip("."))
+
+    def matches(self, url_or_host):
+        labels = host_of(url_or_host).split(".")
+        if self.labels.intersection(labels):
+            return True
+        return any(".".join(labels[i:]) in self.suffixes for i in range(len(labels)))
+
+
+def domain_of(url_or_host):
+    host = host_of(url_or_host)
+    return host[4:] if host.startswith("www.") else host
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    attempts INTEGER,
+    successes INTEGER,
+    blocks INTEGER,
+    seconds REAL,
+    updated_at REAL
+);
+"""
+
+
+class DomainStats:
+    """Per-domain extraction outcomes kept across runs, turned into a ranking adjustment."""
+
+    def __init__(self, db_path=DOMAIN_STATS_PATH):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        # Ranking runs for every anchor, so keep the table in memory and write through
+        self.rows = {r["domain"]: dict(r) for r in self.conn.execute("SELECT * FROM domains")}
+
+    def record(self, url, success, blocked=False, seconds=None):
+        domain = domain_of(url)
+        with self.lock:
+            row = self.rows.setdefault(domain, {"domain": domain, "attempts": 0, "successes": 0, "blocks": 0,
+                                                "seconds": 0.0, "updated_at": 0.0})
+            row["attempts"] += 1
+            row["successes"] += bool(success)
+            row["blocks"] += bool(blocked)
+            row["seconds"] += seconds or 0.0
+            row["updated_at"] = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO domains (domain, attempts, successes, blocks, seconds, updated_at) "
+                              "VALUES (:domain, :attempts, :successes, :blocks, :seconds, :updated_at)", row)
+            self.conn.commit()
+
+    def adjustment(self, url):
+        """Score points to add to the static score: positive for reliable domains, negative for failing ones."""
+        row = self.rows.get(domain_of(url))
+        if not row or not row["attempts"]:
+            return 0.0
+        attempts = row["attempts"]
+        success_rate = (row["successes"] + PRIOR_SUCCESS * PRIOR_WEIGHT) / (attempts + PRIOR_WEIGHT)
+        block_rate = row["blocks"] / (attempts + PRIOR_WEIGHT)
+        latency = row["seconds"] / attempts
+        return (SUCCESS_WEIGHT * (success_rate - PRIOR_SUCCESS)
+                - BLOCK_PENALTY * block_rate
+                - min(latency / SLOW_SECONDS, 2.0))
+
+    def rank(self, urls, score):
+        """Order urls by static score plus learned adjustment, best first (stable for ties)."""
+        return sorted(urls, key=lambda url: score(url) + self.adjustment(url), reverse=True)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import LIMITER, MAX_RETRIES, RETRY_STATUSES, backoff_delay, host_of
+from metrics import METRICS
+
+# ========== CONFIG ==========
+MAX_WORKERS = 16          # Total concurrent downloads
+PER_HOST_LIMIT = 4        # Concurrent downloads against a single host
+CHUNK_SIZE = 64 * 1024    # Bytes read per chunk while streaming to disk
+# ============================
+
+# Per-host slots are shared by every ImageDownloader, so albums downloading at once still respect PER_HOST_LIMIT
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def build_session(headers, cookies=None, pool_size=MAX_WORKERS):
+    """Create a requests session with a connection pool sized for concurrent downloads."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers.update(headers)
+    set_cookies(s, cookies or [])
+    return s
+
+
+def set_cookies(session, cookies):
+    """Copy Selenium-style cookie dicts into a requests session."""
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'])
+
+
+class ImageDownloader:
+    """Download many images concurrently over one pooled session, capped per host across all instances."""
+
+    def __init__(self, session, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT,
+                 max_retries=MAX_RETRIES, chunk_size=CHUNK_SIZE, timeout=30):
+        self.session = session
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def _host_slot(self, url):
+        # The first downloader to reach a host sets its limit
+        host = urlparse(url).netloc.lower()
+        with _host_slots_lock:
+            if host not in _host_slots:
+                _host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return _host_slots[host]
+
+    def _stream_to_file(self, response, dest_path):
+        """Write the response body to disk chunk by chunk, hashing as bytes arrive."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = dest_path + ".part"
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if not chunk:
+                    continue
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, dest_path)
+        return digest.hexdigest(), size
+
+    def fetch(self, url, dest_path, headers=None):
+        """Download a single URL to dest_path. Returns a result dict, or None on failure.
+
+        Pass If-None-Match / If-Modified-Since in headers for a conditional request;
+        a 304 answer returns a result with not_modified=True and leaves the file untouched.
+        """
+        slot = self._host_slot(url)
+        attempt = 0
+        while attempt < self.max_retries:
+            try:
+                with slot:
+                    LIMITER.wait(url)
+                    started = time.monotonic()
+                    with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as response:
+                        LIMITER.report(url, response.status_code, time.monotonic() - started,
+                                       response.headers.get("Retry-After"))
+                        if response.status_code == 304:
+                            if os.path.exists(dest_path):
+                                return {"url": url, "path": dest_path, "not_modified": True, "bytes": 0}
+                            if headers:
+                                headers = None  # Local copy is gone: fetch it unconditionally, same attempt
+                                continue
+                        if response.status_code == 200:
+                            sha256, size = self._stream_to_file(response, dest_path)
+                            logging.info(f"Downloaded {os.path.basename(dest_path)} ({size} bytes)")
+                            return {"url": url, "path": dest_path, "sha256": sha256, "bytes": size,
+                                    "etag": response.headers.get("ETag"),
+                                    "last_modified": response.headers.get("Last-Modified")}
+                        status = response.status_code
+                print(f"[!] Attempt {attempt+1} failed with status {status}")
+                if status not in RETRY_STATUSES:
+                    break
+            except Exception as e:
+                LIMITER.report(url, None)
+                print(f"[!] Attempt {attempt+1} failed: {e}")
+            if attempt < self.max_retries - 1:
+                METRICS.incr("retries", host=host_of(url))
+                time.sleep(backoff_delay(attempt))
+            attempt += 1
+        logging.error(f"Failed to download {url}")
+        if os.path.exists(dest_path + ".part"):
+            os.remove(dest_path + ".part")
+        return None
+
+    def download_all(self, jobs):
+        """Download (url, dest_path[, headers]) jobs concurrently. Results keep the order of jobs."""
+        if not jobs:
+            return []
+        workers = min(self.max_workers, len(jobs))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda job: self.fetch(*job), jobs))
@@ -0,0 +1,156 @@
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException, InvalidSessionIdException
+
+POOL_SIZE = 2        # Warm browsers kept per pool
+MAX_LEASES = 50      # Leases (one album lookup or one crawl page each) served by one browser before it is recycled
+# WebDriverException messages meaning the browser itself is gone, not just that a page misbehaved
+SESSION_LOST_WORDS = ("invalid session id", "session deleted", "chrome not reachable", "disconnected",
+                      "tab crashed", "no such session")
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+# ids of leased browsers that callers reported broken; checked when the lease ends
+_broken = set()
+_broken_lock = threading.Lock()
+
+
+def resolve_driver_path():
+    """Resolve the chromedriver binary once per process instead of once per browser."""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            logging.info("Resolving ChromeDriver using webdriver-manager")
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+def new_chrome(options):
+    """Start a Chrome instance using the shared driver binary."""
+    # selenium.webdriver is only loaded once a browser is actually needed
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    return webdriver.Chrome(service=Service(resolve_driver_path()), options=options)
+
+
+def session_lost(error):
+    """True if error shows the browser session is dead (crashed, closed or unreachable)."""
+    if isinstance(error, InvalidSessionIdException):
+        return True
+    return isinstance(error, WebDriverException) and any(w in str(error).lower() for w in SESSION_LOST_WORDS)
+
+
+def mark_broken(driver, error=None):
+    """Have the pool recycle this browser when its lease ends, instead of handing it out again.
+
+    For callers that catch WebDriverException themselves, so it never reaches the pool. With an
+    error, the browser is only flagged if the error shows its session is lost. Returns True if flagged.
+    """
+    if error is not None and not session_lost(error):
+        return False
+    with _broken_lock:
+        _broken.add(id(driver))
+    return True
+
+
+class DriverPool:
+    """Fixed-size pool of warm Chrome instances shared by worker threads.
+
+    Browsers are handed out with `with pool.driver() as driver:` and are recycled
+    after max_leases leases, or immediately if the lease ends with a WebDriverException
+    or the browser was flagged with mark_broken().
+    """
+
+    def __init__(self, options_factory, size=POOL_SIZE, max_leases=MAX_LEASES, headless=True):
+        self.options_factory = options_factory
+        self.size = size
+        self.max_leases = max_leases
+        self.headless = headless
+        self._idle = queue.Queue()
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _start(self):
+        options = self.options_factory()
+        if self.headless:
+            options.add_argument("--headless=new")
+        driver = new_chrome(options)
+        with self._lock:
+            self._leases[id(driver)] = 0
+        return driver
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._leases.pop(id(driver), None)
+            self._started -= 1
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_start = self._started < self.size
+                if can_start:
+                    self._started += 1
+            if can_start:
+                try:
+                    return self._start()
+                except Exception:
+                    with self._lock:
+                        self._started -= 1
+                    raise
+            # Wake up periodically in case a recycled browser freed a slot
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def warm_up(self):
+        """Start all browsers up front so the first workers do not pay the startup cost."""
+        drivers = [self._acquire() for _ in range(self.size)]
+        for driver in drivers:
+            self._idle.put(driver)
+
+    @contextmanager
+    def driver(self):
+        driver = self._acquire()
+        crashed = False
+        try:
+            yield driver
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            with _broken_lock:
+                if id(driver) in _broken:
+                    _broken.discard(id(driver))
+                    crashed = True
+            with self._lock:
+                self._leases[id(driver)] = leases = self._leases.get(id(driver), 0) + 1
+            if crashed or self._closed or leases >= self.max_leases:
+                logging.info("Recycling browser" + (" after crash" if crashed else ""))
+                self._discard(driver)
+            else:
+                self._idle.put(driver)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
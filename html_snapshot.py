@@ -0,0 +1,116 @@
+from html.parser import HTMLParser
+
+# Elements whose text content is captured while parsing
+TEXT_TAGS = {"a", "li", "p", "title", "h1"}
+# Block elements whose start implicitly closes an open <p>
+BLOCK_TAGS = {"p", "li", "ul", "ol", "div", "table", "section", "h1", "h2", "h3"}
+
+
+class HtmlSnapshot:
+    """Parsed view of a static HTML document: tags with attributes, text blocks, meta and JSON-LD."""
+
+    def __init__(self):
+        self.title = ""
+        self.meta = {}
+        self.json_ld = []
+        self.elements = []
+
+    def find_all(self, tag, classes=(), **attrs):
+        """Return elements matching a tag, a set of CSS classes and exact attribute values.
+
+        Attribute names use underscores in place of dashes, e.g. data_type="photo".
+        An attribute value of True only requires the attribute to be present.
+        """
+        wanted = {k.replace("_", "-"): v for k, v in attrs.items()}
+        matches = []
+        for el in self.elements:
+            if el["tag"] != tag:
+                continue
+            el_attrs = el["attrs"]
+            if classes and not set(classes).issubset((el_attrs.get("class") or "").split()):
+                continue
+            ok = True
+            for name, value in wanted.items():
+                if value is True:
+                    ok = name in el_attrs
+                else:
+                    ok = el_attrs.get(name) == value
+                if not ok:
+                    break
+            if ok:
+                matches.append(el)
+        return matches
+
+    def texts(self, *tags):
+        """Return the stripped text of every element with one of the given tags, in document order."""
+        return [el["text"].strip() for el in self.elements if el["tag"] in tags and el["text"].strip()]
+
+
+class _SnapshotParser(HTMLParser):
+    def __init__(self, snapshot):
+        super().__init__(convert_charrefs=True)
+        self.snapshot = snapshot
+        self.open_text = []
+        self.in_json_ld = False
+        self.in_raw_text = False
+        self.json_ld_buffer = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v if v is not None else "") for k, v in attrs}
+        if tag == "meta":
+            key = attrs.get("property") or attrs.get("name")
+            if key and key.lower() not in self.snapshot.meta:
+                self.snapshot.meta[key.lower()] = attrs.get("content", "")
+        elif tag == "script" and attrs.get("type", "").lower() == "application/ld+json":
+            self.in_json_ld = True
+            self.json_ld_buffer = []
+        elif tag in ("script", "style"):
+            self.in_raw_text = True
+
+        # Browsers implicitly close an open <p> at the next block and an open <li> at the next item
+        if tag in BLOCK_TAGS and self.open_text and self.open_text[-1]["tag"] == "p":
+            self.open_text.pop()
+        if tag == "li" and self.open_text and self.open_text[-1]["tag"] == "li":
+            self.open_text.pop()
+
+        element = {"tag": tag, "attrs": attrs, "text": ""}
+        self.snapshot.elements.append(element)
+        if tag in TEXT_TAGS:
+            self.open_text.append(element)
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self.in_json_ld:
+            self.snapshot.json_ld.append("".join(self.json_ld_buffer))
+            self.in_json_ld = False
+            return
+        if tag in ("script", "style"):
+            self.in_raw_text = False
+            return
+        if tag in ("ul", "ol"):
+            while self.open_text and self.open_text[-1]["tag"] in ("li", "p"):
+                self.open_text.pop()
+            return
+        for i in range(len(self.open_text) - 1, -1, -1):
+            if self.open_text[i]["tag"] == tag:
+                element = self.open_text.pop(i)
+                if tag == "title" and not self.snapshot.title:
+                    self.snapshot.title = element["text"].strip()
+                break
+
+    def handle_data(self, data):
+        if self.in_json_ld:
+            self.json_ld_buffer.append(data)
+            return
+        if self.in_raw_text:
+            return
+        for element in self.open_text:
+            element["text"] += data
+
+
+def parse_html(html):
+    """Parse an HTML string into an HtmlSnapshot."""
+    snapshot = HtmlSnapshot()
+    parser = _SnapshotParser(snapshot)
+    parser.feed(html or "")
+    parser.close()
+    return snapshot
@@ -0,0 +1,138 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Without Pillow the original files are used as-is
+    Image = None
+
+from image_store import file_sha256
+
+# ========== CONFIG ==========
+DERIVED_DIR = "downloads/_derived"
+MAX_DIMENSION = 2048      # Longest side of the image uploaded to Shopify
+THUMB_DIMENSION = 512     # Longest side of the image sent to visual search
+OUTPUT_FORMAT = "JPEG"    # "JPEG" or "WEBP"
+QUALITY = 85
+THUMB_QUALITY = 80
+WORKERS = os.cpu_count() or 2
+INLINE_BATCH = 2          # Batches this small are processed in the calling thread instead of the pool
+BACKGROUND = (255, 255, 255)  # Transparent areas are flattened onto this colour
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# ============================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _profile():
+    # Part of every derivative name, so changing the settings never reuses stale files
+    background = "".join(f"{c:02x}" for c in BACKGROUND)
+    return f"{OUTPUT_FORMAT.lower()}{MAX_DIMENSION}q{QUALITY}_t{THUMB_DIMENSION}q{THUMB_QUALITY}_bg{background}"
+
+
+def derivative_paths(sha256):
+    """Cache locations of the normalized image and the thumbnail for a source hash."""
+    ext = ".webp" if OUTPUT_FORMAT == "WEBP" else ".jpg"
+    folder = os.path.join(DERIVED_DIR, sha256[:2])
+    base = f"{sha256}_{_profile()}"
+    return os.path.join(folder, base + ext), os.path.join(folder, base + "_thumb" + ext)
+
+
+def _flatten(img):
+    # JPEG has no alpha: composite transparent images onto the background instead of dropping the channel
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        flat = Image.new("RGB", img.size, BACKGROUND)
+        flat.paste(img, mask=img.getchannel("A"))
+        return flat
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def _save(img, path, max_side, quality):
+    img = img.copy()
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    tmp = path + ".tmp"
+    # Saving without exif= drops the EXIF block; orientation was already applied
+    img.save(tmp, OUTPUT_FORMAT, quality=quality, optimize=True)
+    os.replace(tmp, path)
+
+
+def preprocess_image(src):
+    """Produce the normalized image and thumbnail for src. Idempotent: cached by source hash.
+
+    Returns {"source", "sha256", "normalized", "thumbnail"}; the derivative paths fall back
+    to src when Pillow is missing or the image cannot be decoded.
+    """
+    sha256 = file_sha256(src)
+    result = {"source": src, "sha256": sha256, "normalized": src, "thumbnail": src}
+    if Image is None:
+        return result
+    normalized, thumbnail = derivative_paths(sha256)
+    if os.path.exists(normalized) and os.path.exists(thumbnail):
+        result.update(normalized=normalized, thumbnail=thumbnail)
+        return result
+    try:
+        os.makedirs(os.path.dirname(normalized), exist_ok=True)
+        with Image.open(src) as img:
+            img = _flatten(ImageOps.exif_transpose(img))
+            _save(img, normalized, MAX_DIMENSION, QUALITY)
+            _save(img, thumbnail, THUMB_DIMENSION, THUMB_QUALITY)
+    except Exception as e:
+        logging.warning(f"Could not preprocess {src}: {e}")
+        return result
+    result.update(normalized=normalized, thumbnail=thumbnail)
+    return result
+
+
+def _cached_result(src):
+    sha256 = file_sha256(src)
+    normalized, thumbnail = derivative_paths(sha256)
+    if os.path.exists(normalized) and os.path.exists(thumbnail):
+        return {"source": src, "sha256": sha256, "normalized": normalized, "thumbnail": thumbnail}
+    return None
+
+
+def shared_pool():
+    """The module's process pool, started on first use and kept for the life of the process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        return _pool
+
+
+def preprocess_all(paths, executor=None):
+    """Preprocess many images in a process pool (the shared one unless executor is given).
+
+    Returns {source path: result}. Images whose derivatives are already cached, and
+    batches of at most INLINE_BATCH images, are handled inline, so a cached album
+    never touches the pool.
+    """
+    results = {}
+    pending = []
+    for src in paths:
+        cached = _cached_result(src) if Image is not None else None
+        if cached:
+            results[src] = cached
+        else:
+            pending.append(src)
+    if len(pending) <= INLINE_BATCH or Image is None:
+        results.update((src, preprocess_image(src)) for src in pending)
+    else:
+        results.update(zip(pending, (executor or shared_pool()).map(preprocess_image, pending)))
+    return results
+
+
+def album_images(album_path):
+    return [os.path.join(album_path, f) for f in os.listdir(album_path) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def album_derivatives(album_path, executor=None):
+    """Derivatives for every image in an album folder, keyed by file name."""
+    results = preprocess_all(album_images(album_path), executor)
+    return {os.path.basename(src): result for src, result in results.items()}
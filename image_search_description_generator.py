@@ -2,22 +2,36 @@ import os
 import time
 import json
 import random
+import logging
+import threading
 from urllib.parse import urlparse
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-from openai import OpenAI
-
-client = OpenAI(api_key="Your API Key")  # replace with your actual key
+from selenium.common.exceptions import TimeoutException
+from driver_pool import DriverPool, new_chrome, mark_broken
+from rate_limiter import LIMITER
+from metrics import METRICS
+from image_preprocess import album_derivatives, album_images, preprocess_all
+from image_store import ImageStore, dhash
+from lens_cache import LensCache
+from page_cache import PageCache, normalize_url
+from catalog import Catalog, format_details
+from domain_ranker import DomainMatcher, DomainStats
+from llm_rewriter import Rewriter, BATCH_MODE
+from page_extractor import extract_candidates, extract_from_html, is_valid_text, contains_error_messages
 
 TARGET_FOLDER = r"downloads\Chanel_Wallet"
 PRODUCT_CATEGORY = "Wallet"
 BRAND_NAME = "Chanel"
 BRAND_DOMAINS = ["chanel.com"]
+ALBUM_WORKERS = 2   # Albums enriched in parallel, one pooled browser each
+HEADLESS = True
+PARALLEL_SEARCHES = 3   # Lens searches run side by side in tabs per album; 1 searches one image at a time
+CONFIDENT_SCORE = 12    # A top link ranked this high (brand site + .com) cancels the remaining searches
+EXTRACTION_MODE = "snapshot"   # "snapshot": parse one page_source in-process; "elements": read every node over WebDriver
 
 BAD_DOMAINS = ['pinterest.', 'reddit.', 'tumblr.', 'quora.', 'youtube.', 'google.', 'wikipedia.',
                'facebook.', 'instagram.', 'twitter.', 'tiktok.', '.kr', '.cn', '.jp', '.ru',
@@ -25,14 +39,25 @@ BAD_DOMAINS = ['pinterest.', 'reddit.', 'tumblr.', 'quora.', 'youtube.', 'google
 
 TOP_DOMAINS = ["farfetch", "nordstrom", "saksfifthavenue", "neimanmarcus", "bloomingdales", "ssense", "mytheresa", "net-a-porter", "ebay"]
 
-def setup_driver():
+# Compiled once; collect_links checks every anchor on the results page
+BAD_HOSTS = DomainMatcher(BAD_DOMAINS)
+TOP_HOSTS = DomainMatcher(TOP_DOMAINS)
+BRAND_HOSTS = DomainMatcher(BRAND_DOMAINS)
+
+_rewriter = None
+_rewriter_lock = threading.Lock()
+
+def chrome_options():
     options = Options()
     options.add_argument("--start-maximized")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
     options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    return options
+
+def setup_driver():
+    return new_chrome(chrome_options())
 
 def handle_google_consent(driver):
     try:
@@ -59,11 +84,11 @@ def score_link(href):
     score = 0
     parsed = urlparse(href)
     netloc = parsed.netloc.lower()
-    if any(brand_domain in netloc for brand_domain in BRAND_DOMAINS):
+    if BRAND_HOSTS.matches(netloc):
         score += 10
     if BRAND_NAME.lower() in href.lower():
         score += 3
-    if any(domain in netloc for domain in TOP_DOMAINS):
+    if TOP_HOSTS.matches(netloc):
         score += 5
     if netloc.endswith(('.com', '.co.uk', '.de', '.fr', '.it', '.net', '.eu')):
         score += 2
@@ -71,25 +96,21 @@ def score_link(href):
         score += 1
     return score
 
-def is_valid_text(text):
-    if not text or len(text.strip()) < 5:
-        return False
-    lower_text = text.lower()
-    if "just a moment" in lower_text:
-        return False
-    spam_keywords = ["paypal", "bonifico", "spedizione", "tracciabile", "contatti", "whatsapp", "imballaggio"]
-    if any(spam in lower_text for spam in spam_keywords):
-        return False
-    return True
-
-def contains_error_messages(text):
-    lower_text = text.lower()
-    error_keywords = ["this item does not exist", "we have detected unusual activity", "access denied", "this site can’t be reached", "this site cannot be reached", "page isn’t working"]
-    return any(keyword in lower_text for keyword in error_keywords)
+def wait_for_links_to_settle(driver, timeout=4):
+    # Lens keeps appending results after readyState; stop once the link count holds steady
+    counts = []
+    def settled(d):
+        counts.append(len(d.find_elements(By.CSS_SELECTOR, "a[href]")))
+        return len(counts) >= 3 and counts[-1] == counts[-2] == counts[-3]
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.5).until(settled)
+    except Exception:
+        pass
 
+@METRICS.timed("collect_links")
 def collect_links(driver):
     WebDriverWait(driver, 10).until(lambda d: d.execute_script("return document.readyState") == "complete")
-    time.sleep(random.uniform(2, 4))
+    wait_for_links_to_settle(driver)
     anchors = driver.find_elements(By.CSS_SELECTOR, "a[href]")
     scored = []
     for a in anchors:
@@ -97,14 +118,41 @@ def collect_links(driver):
         if href and href.startswith("http"):
             parsed = urlparse(href)
             netloc = parsed.netloc.lower()
-            if not any(bad in netloc for bad in BAD_DOMAINS):
+            if not BAD_HOSTS.matches(netloc):
                 score = score_link(href)
                 if score > 0:
                     scored.append((score, href))
     scored.sort(reverse=True)
     return [h for _, h in scored]
 
-def extract_product_details(driver):
+# True once the page has product metadata or enough rendered text to read details from
+CONTENT_READY_JS = """
+return !!document.querySelector("script[type='application/ld+json'], meta[property='og:title']")
+    || (document.body && document.body.innerText.length > 200);
+"""
+
+@METRICS.timed("extract_product_details")
+def extract_product_details(driver, mode=None):
+    if (mode or EXTRACTION_MODE) == "elements":
+        return extract_product_details_elements(driver)
+    try:
+        WebDriverWait(driver, 10).until(lambda x: x.execute_script("return document.readyState") == "complete")
+        try:
+            WebDriverWait(driver, 3, poll_frequency=0.2).until(lambda x: x.execute_script(CONTENT_READY_JS))
+        except TimeoutException:
+            pass  # Extract whatever is there
+
+        # One round trip for the whole DOM; error, JSON-LD and keyword checks all run locally
+        result = extract_from_html(driver.page_source, rendered=True)
+        if result["name"] and result["desc"]:
+            return result["name"], result["desc"]
+        print("⚠️ No usable product details on page. Skipping.")
+    except Exception as e:
+        print(f"⚠️ Error extracting product details: {e}")
+        mark_broken(driver, e)
+    return None, None
+
+def extract_product_details_elements(driver):
     try:
         WebDriverWait(driver, 10).until(lambda x: x.execute_script("return document.readyState") == "complete")
         time.sleep(random.uniform(2, 3))
@@ -158,6 +206,7 @@ def extract_product_details(driver):
 
     except Exception as e:
         print(f"⚠️ Error extracting product details: {e}")
+        mark_broken(driver, e)
     return None, None
 
 def get_category_price(folder_name):
@@ -177,129 +226,347 @@ def get_category_price(folder_name):
     else:
         return random.randint(250, 300)
 
-def save_product_details(folder, brand, name, desc, price):
-    details_file = os.path.join(folder, "product_details.txt")
-    with open(details_file, "w", encoding="utf-8") as f:
-        f.write(f"Brand: {brand}\n")
-        f.write(f"Product Name: {name}\n")
-        f.write(f"Description: {desc}\n")
-        f.write(f"Price: ${price}\n")
-    print(f"✔️ Saved details to {details_file}")
-    return details_file
-
-def improve_product_text(context_details, original_name, original_desc, category):
-    prompt = (
-        f"You are an expert fashion product copywriter.\n\n"
-        f"Rewrite the product name and description for a high-end online store, using simple, sophisticated, and inviting language.\n\n"
-        f"Guidelines:\n"
-        f"- Create a short, catchy product name (max 7 words).\n"
-        f"- Write a soft, smooth, story-like description in 3 to 4 lines.\n"
-        f"- Mention material or dimensions if available, in a natural way.\n"
-        f"- Do not mention color.\n"
-        f"- Highlight comfort, style, or daily use, so it feels relatable.\n"
-        f"- Do not mention store names, disclaimers, or brand name in the name.\n"
-        f"- Do not invent new details.\n\n"
-        f"Context Details:\n{context_details}\n\n"
-        f"Original Product Name: {original_name}\n"
-        f"Original Description: {original_desc}\n\n"
-        f"Return the new product name first, then the new description, separated by a line break.\n"
-    )
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a professional luxury product copywriter."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        improved_text = response.choices[0].message.content.strip()
-        lines = improved_text.split("\n", 1)
-        if len(lines) >= 2:
-            return lines[0].strip(), lines[1].strip()
-        else:
-            return original_name, original_desc
-    except Exception as e:
-        print(f"⚠️ OpenAI error: {e}")
-        return original_name, original_desc
-
-def process_single_folder(folder_path):
-    driver = setup_driver()
-    try:
-        print(f"Processing folder: {folder_path}")
-        albums = os.listdir(folder_path)
-        for album in albums:
-            album_path = os.path.join(folder_path, album)
-            if not os.path.isdir(album_path):
-                continue
-
-            images = [f for f in os.listdir(album_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            if not images:
-                continue
-
-            best_name, best_desc = None, None
-
-            for image_path in images[:6]:  # Upload first 6 images
-                full_image_path = os.path.join(album_path, image_path)
-                driver.get("https://www.google.com/imghp?hl=en")
-                handle_google_consent(driver)
-
-                camera_icon = WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "div[aria-label='Search by image']")))
-                camera_icon.click()
-                upload_input = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']")))
-                upload_input.send_keys(os.path.abspath(full_image_path))
-
-                WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.CSS_SELECTOR, "a[href]")))
-
-                links = collect_links(driver)
-                for link in links:
-                    driver.execute_script("window.open(arguments[0]);", link)
-                    WebDriverWait(driver, 10).until(lambda d: len(d.window_handles) > 1)
-
-                    new_handle = [h for h in driver.window_handles if h != driver.current_window_handle][0]
-                    driver.switch_to.window(new_handle)
-
-                    close_brand_popups(driver)
-                    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(random.uniform(2, 4))
-
-                    name, desc = extract_product_details(driver)
-                    driver.close()
-                    driver.switch_to.window(driver.window_handles[0])
-
-                    if name and desc:
-                        best_name, best_desc = name, desc
-                        break  # Stop if found valid details
-
-                if best_name and best_desc:
-                    break  # Stop processing more images if we already have best
-
-            price = get_category_price(os.path.basename(folder_path))
+def save_product_details(catalog, album_path, brand, name, desc, price, images):
+    catalog.save_found(album_path, brand, name, desc, price, images)
+    print(f"✔️ Saved details for {os.path.basename(album_path)} to the catalog")
+    return album_path
+
+@METRICS.timed("improve_product_text")
+def improve_product_text(context_details, original_name, original_desc, category, rewriter=None):
+    rewriter = rewriter or default_rewriter()
+    return rewriter.rewrite(context_details, original_name, original_desc, category)
+
+def default_rewriter():
+    # Callers without a rewriter of their own share one, created on first use, with its budgets and cache
+    global _rewriter
+    with _rewriter_lock:
+        if _rewriter is None:
+            _rewriter = Rewriter(workers=1)
+        return _rewriter
+
+def cached_product_details(store, album_path, images):
+    # Reuse details already found for any of these images (or a near-duplicate) in another album
+    for image_path in images:
+        cached = store.find_stage_result(os.path.join(album_path, image_path), "product_details")
+        if cached:
+            name, desc = json.loads(cached)
+            return name, desc
+    return None, None
 
-            if not best_name:
-                best_name = "Unknown Product"
-            if not best_desc:
-                best_desc = "No valid description found"
+def remember_product_details(store, album_path, images, name, desc):
+    result = json.dumps([name, desc])
+    for image_path in images:
+        sha256 = store.add(os.path.join(album_path, image_path))
+        store.save_stage_result(sha256, "product_details", result)
+
+def search_image_path(album_path, image_path, derivatives):
+    # Visual search only needs the small thumbnail, not the full-size original
+    if image_path in derivatives:
+        return derivatives[image_path]["thumbnail"]
+    return os.path.join(album_path, image_path)
+
+def lens_lookups(lens_cache, album_path, images, derivatives):
+    # (image name, path sent to Lens, perceptual hash, cache entry or None) for the first 6 images.
+    # Each image is looked up once and the result passed along, so cache hits and misses count once.
+    lookups = []
+    for image_path in images[:6]:  # Upload first 6 images
+        full_image_path = search_image_path(album_path, image_path, derivatives)
+        phash = dhash(full_image_path) if lens_cache else None
+        lookups.append((image_path, full_image_path, phash, lens_cache.lookup(phash) if phash else None))
+    return lookups
+
+def cached_lens_details(lookups):
+    # Serve the album from an earlier search on the same (or a near-identical) product shot
+    for _, _, _, cached in lookups:
+        if cached and cached["name"] and cached["description"]:
+            return cached["name"], cached["description"]
+    return None, None
 
-            txt_file = save_product_details(album_path, BRAND_NAME, best_name, best_desc, price)
+@METRICS.timed("lens_submit")
+def submit_lens_search(driver, full_image_path):
+    # Start a Lens search in the current tab; Google keeps working on it while we switch away
+    LIMITER.wait("https://www.google.com/imghp?hl=en")
+    driver.get("https://www.google.com/imghp?hl=en")
+    handle_google_consent(driver)
+
+    camera_icon = WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "div[aria-label='Search by image']")))
+    camera_icon.click()
+    upload_input = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']")))
+    upload_input.send_keys(os.path.abspath(full_image_path))
+
+def lens_search(driver, full_image_path):
+    submit_lens_search(driver, full_image_path)
+    WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.CSS_SELECTOR, "a[href]")))
+    return collect_links(driver)
+
+def search_targets(lookups):
+    # (image name, path sent to Lens, perceptual hash, cached links or None) for each looked-up image
+    targets = []
+    for image_path, full_image_path, phash, cached in lookups:
+        if cached and cached["links"] is not None:
+            print(f"♻️ Using cached Lens results for {image_path}")
+            targets.append((image_path, full_image_path, phash, cached["links"]))
+        else:
+            targets.append((image_path, full_image_path, phash, None))
+    return targets
+
+def link_rank(domain_stats):
+    if domain_stats is None:
+        return score_link
+    return lambda link: score_link(link) + domain_stats.adjustment(link)
+
+def merge_links(link_lists, rank):
+    # One ranked candidate list, each page once however many searches returned it
+    merged = {}
+    for links in link_lists:
+        for link in links:
+            merged.setdefault(normalize_url(link), link)
+    return sorted(merged.values(), key=rank, reverse=True)
+
+def parallel_lens_searches(driver, targets, lens_cache, rank):
+    # Submit every uncached search in its own tab first, then harvest the tabs in order.
+    # A confident top link (e.g. the brand's own site) cancels the searches still pending.
+    link_lists = [links for _, _, _, links in targets if links is not None]
+    if any(links and rank(links[0]) >= CONFIDENT_SCORE for links in link_lists):
+        return link_lists
+    main_handle = driver.current_window_handle
+    tabs = []
+    for image_path, full_image_path, phash, links in targets:
+        if links is not None:
+            continue
+        driver.switch_to.new_window("tab")
+        try:
+            submit_lens_search(driver, full_image_path)
+            tabs.append((driver.current_window_handle, image_path, phash))
+        except Exception as e:
+            print(f"⚠️ Lens search failed for {image_path}: {e}")
+            mark_broken(driver, e)
+            driver.close()
+        driver.switch_to.window(main_handle)
+
+    for i, (handle, image_path, phash) in enumerate(tabs):
+        driver.switch_to.window(handle)
+        try:
+            WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.CSS_SELECTOR, "a[href]")))
+            links = collect_links(driver)
+        except Exception as e:
+            print(f"⚠️ Lens search failed for {image_path}: {e}")
+            mark_broken(driver, e)
+            links = None
+        driver.close()
+        driver.switch_to.window(main_handle)
+        if links is None:
+            continue  # A timeout or bot wall is not "no results"; leave it uncached so it is searched again
+        if phash:
+            lens_cache.store_links(phash, links)
+        link_lists.append(links)
+        if links and rank(links[0]) >= CONFIDENT_SCORE:
+            print(f"🎯 Confident match from {image_path}; cancelling {len(tabs) - i - 1} pending searches")
+            for other, _, _ in tabs[i + 1:]:
+                driver.switch_to.window(other)
+                driver.close()
+            driver.switch_to.window(main_handle)
+            break
+    return link_lists
+
+def extract_from_links(driver, links, page_cache=None, domain_stats=None):
+    # Fetch the candidates concurrently over HTTP; only JavaScript-dependent pages need a tab
+    best, js_pages = extract_candidates(links, score_link, page_cache=page_cache, domain_stats=domain_stats)
+    if best:
+        print(f"✔️ Extracted details over HTTP from {best['url']}")
+        return best["name"], best["desc"]
+
+    for page in js_pages:
+        link = page["url"]
+        LIMITER.wait(link)
+        driver.execute_script("window.open(arguments[0]);", link)
+        WebDriverWait(driver, 10).until(lambda d: len(d.window_handles) > 1)
+
+        new_handle = [h for h in driver.window_handles if h != driver.current_window_handle][0]
+        driver.switch_to.window(new_handle)
+
+        started = time.monotonic()
+        close_brand_popups(driver)
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+
+        name, desc = extract_product_details(driver)
+        driver.close()
+        driver.switch_to.window(driver.window_handles[0])
+        if domain_stats is not None:
+            # One record per page: the browser decided it, a 403/429/503 over HTTP still counts as a block
+            domain_stats.record(link, name and desc, blocked=page["blocked"],
+                                seconds=page["seconds"] + time.monotonic() - started)
+        if page_cache is not None:
+            if name and desc:
+                page_cache.put_hit(link, name, desc)
+            else:
+                page_cache.put_miss(link, "browser_no_details")
+
+        if name and desc:
+            return name, desc  # Stop if found valid details
+    return None, None
 
-            with open(txt_file, "r", encoding="utf-8") as f:
-                content = f.read()
+def find_product_details(driver, album_path, images, derivatives=None, lens_cache=None, page_cache=None,
+                         domain_stats=None, lookups=None):
+    if lookups is None:
+        lookups = lens_lookups(lens_cache, album_path, images, derivatives or {})
+    targets = search_targets(lookups)
+    # Domains that have given valid details before are tried first
+    rank = link_rank(domain_stats)
+
+    if PARALLEL_SEARCHES > 1:
+        for start in range(0, len(targets), PARALLEL_SEARCHES):
+            group = targets[start:start + PARALLEL_SEARCHES]
+            links = merge_links(parallel_lens_searches(driver, group, lens_cache, rank), rank)
+            name, desc = extract_from_links(driver, links, page_cache, domain_stats)
+            if name and desc:
+                for _, _, phash, _ in group:
+                    if phash:
+                        lens_cache.store_result(phash, name, desc)
+                return name, desc
+        return None, None
+
+    for image_path, full_image_path, phash, links in targets:
+        if links is None:
+            try:
+                links = lens_search(driver, full_image_path)
+            except Exception as e:
+                print(f"⚠️ Lens search failed for {image_path}: {e}")
+                mark_broken(driver, e)
+                continue  # Only searches that returned are cached
+            if phash:
+                lens_cache.store_links(phash, links)
+
+        name, desc = extract_from_links(driver, sorted(links, key=rank, reverse=True), page_cache, domain_stats)
+        if name and desc:
+            if phash:
+                lens_cache.store_result(phash, name, desc)
+            return name, desc
+    return None, None
 
-            improved_name, improved_desc = improve_product_text(content, best_name, best_desc, PRODUCT_CATEGORY)
+@METRICS.timed("lookup_album", album="album_path")
+def lookup_album_details(pool, store, catalog, folder_path, album_path, lens_cache=None, page_cache=None,
+                         domain_stats=None):
+    # Lens search + extraction stage: records the raw details in the catalog and returns what the rewrite needs
+    images = [f for f in os.listdir(album_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    if not images:
+        return None
+
+    best_name, best_desc = cached_product_details(store, album_path, images[:6])
+    derivatives = album_derivatives(album_path)
+    lookups = None
+    if not best_name and lens_cache:
+        lookups = lens_lookups(lens_cache, album_path, images, derivatives)
+        best_name, best_desc = cached_lens_details(lookups)
+    if best_name:
+        print(f"♻️ Reusing details found for the same image: {best_name}")
+    else:
+        # Only albums that miss the cache need a browser
+        with pool.driver() as driver:
+            best_name, best_desc = find_product_details(driver, album_path, images, derivatives, lens_cache, page_cache,
+                                                         domain_stats, lookups)
+        if best_name and best_desc:
+            remember_product_details(store, album_path, images, best_name, best_desc)
+
+    # Keep the price an earlier run picked, so re-enriching does not change the product
+    existing = catalog.product(album_path)
+    if existing and existing["price"] is not None:
+        price = existing["price"]
+    else:
+        price = get_category_price(os.path.basename(folder_path))
+
+    if not best_name:
+        best_name = "Unknown Product"
+    if not best_desc:
+        best_desc = "No valid description found"
+
+    save_product_details(catalog, album_path, BRAND_NAME, best_name, best_desc, price, images)
+    return album_path, best_name, best_desc
+
+def write_improved_details(catalog, album_path, improved_name, improved_desc):
+    catalog.save_rewrite(album_path, improved_name, improved_desc)
+    print(f"✅ Improved and updated: {os.path.basename(album_path)}")
+    return album_path
+
+def read_details(catalog, album_path):
+    return format_details(catalog.product(album_path))
+
+@METRICS.timed("rewrite_album", album="album_path")
+def rewrite_album_details(catalog, album_path, best_name, best_desc, rewriter=None):
+    # LLM rewrite stage: replaces the raw details with the improved name and description
+    content = read_details(catalog, album_path)
+    improved_name, improved_desc = improve_product_text(content, best_name, best_desc, PRODUCT_CATEGORY, rewriter)
+    return write_improved_details(catalog, album_path, improved_name, improved_desc)
+
+def queue_album_rewrite(rewriter, catalog, album_path, best_name, best_desc):
+    # Hand the rewrite to the background pool so the browser can move on to the next album
+    future = rewriter.submit(read_details(catalog, album_path), best_name, best_desc, PRODUCT_CATEGORY)
+    future.add_done_callback(lambda f: write_rewrite_result(catalog, album_path, f))
+    return future
+
+def write_rewrite_result(catalog, album_path, future):
+    # Done callbacks swallow exceptions, so failures are reported here
+    try:
+        write_improved_details(catalog, album_path, *future.result())
+    except Exception as e:
+        print(f"[!] Rewrite failed for {os.path.basename(album_path)}: {e}")
+        logging.error(f"Rewrite failed for {album_path}: {e}")
 
-            with open(txt_file, "w", encoding="utf-8") as f:
-                f.write(f"Brand: {BRAND_NAME}\n")
-                f.write(f"Product Name: {improved_name}\n")
-                f.write(f"Description: {improved_desc}\n")
-                f.write(f"Price: ${price}\n")
+def process_album(pool, store, catalog, folder_path, album_path, lens_cache=None, rewriter=None, page_cache=None,
+                  domain_stats=None):
+    found = lookup_album_details(pool, store, catalog, folder_path, album_path, lens_cache, page_cache, domain_stats)
+    if found and rewriter is not None:
+        return queue_album_rewrite(rewriter, catalog, *found)
+    if found:
+        rewrite_album_details(catalog, *found)
 
-            print(f"✅ Improved and updated: {txt_file}")
+def process_single_folder(folder_path):
+    pool = DriverPool(chrome_options, size=ALBUM_WORKERS, headless=HEADLESS)
+    store = ImageStore()
+    catalog = Catalog(folder_path)
+    lens_cache = LensCache()
+    page_cache = PageCache()
+    domain_stats = DomainStats()
+    rewriter = Rewriter()
+    found_albums = []
+    try:
+        print(f"Processing folder: {folder_path}")
+        album_paths = [os.path.join(folder_path, album) for album in os.listdir(folder_path)]
+        album_paths = [p for p in album_paths if os.path.isdir(p)]
+        # Resize/recompress every image up front in a process pool; albums then hit the cache
+        preprocess_all([img for album_path in album_paths for img in album_images(album_path)])
 
-            time.sleep(random.uniform(2, 4))
+        def run(album_path):
+            try:
+                if BATCH_MODE:
+                    found = lookup_album_details(pool, store, catalog, folder_path, album_path, lens_cache,
+                                                 page_cache, domain_stats)
+                    if found:
+                        found_albums.append(found)
+                else:
+                    process_album(pool, store, catalog, folder_path, album_path, lens_cache, rewriter,
+                                  page_cache, domain_stats)
+            except Exception as e:
+                print(f"⚠️ Failed album {album_path}: {e}")
+
+        with ThreadPoolExecutor(max_workers=ALBUM_WORKERS) as workers:
+            list(workers.map(run, album_paths))
+
+        if found_albums:
+            jobs = [(read_details(catalog, album_path), name, desc, PRODUCT_CATEGORY)
+                    for album_path, name, desc in found_albums]
+            for (album_path, _, _), improved in zip(found_albums, rewriter.rewrite_batch(jobs)):
+                write_improved_details(catalog, album_path, *improved)
     finally:
-        driver.quit()
+        pool.close()
+        store.close()
+        rewriter.close()
+        catalog.close()
+        print(f"🔎 Lens cache: {lens_cache.hits} hits, {lens_cache.misses} misses")
+        lens_cache.close()
+        print(f"📄 Page cache: {page_cache.hits} hits, {page_cache.misses} misses")
+        page_cache.close()
+        domain_stats.close()
         print("\n✅ All albums processed.")
 
 if __name__ == "__main__":
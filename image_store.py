@@ -0,0 +1,261 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from db import locked
+
+try:
+    from PIL import Image
+except ImportError:  # Perceptual hashing is skipped without Pillow
+    Image = None
+
+STORE_DIR = "downloads/_store"
+DUPLICATE_DISTANCE = 6        # Max Hamming distance between dHashes of the "same" photo
+DUPLICATE_ALBUM_RATIO = 0.8   # Share of an album's images that must match another album
+BAND_BITS = 8                 # 64-bit hash split into 8 bands; any pair within 7 bits shares a band
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT,
+    phash TEXT,
+    size INTEGER,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    ref_path TEXT PRIMARY KEY,
+    album_path TEXT,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS refs_by_album ON refs (album_path);
+CREATE INDEX IF NOT EXISTS refs_by_sha ON refs (sha256);
+CREATE TABLE IF NOT EXISTS phash_bands (
+    band INTEGER,
+    value INTEGER,
+    sha256 TEXT,
+    PRIMARY KEY (band, value, sha256)
+);
+CREATE TABLE IF NOT EXISTS duplicate_albums (
+    album_path TEXT PRIMARY KEY,
+    duplicate_of TEXT,
+    ratio REAL
+);
+CREATE TABLE IF NOT EXISTS stage_results (
+    sha256 TEXT,
+    stage TEXT,
+    result TEXT,
+    updated_at REAL,
+    PRIMARY KEY (sha256, stage)
+);
+"""
+
+
+def file_sha256(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(path, size=8):
+    """64-bit difference hash of an image as a hex string, or None if Pillow is unavailable."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            pixels = list(img.convert("L").resize((size + 1, size)).getdata())
+    except Exception as e:
+        logging.warning(f"Could not hash {path}: {e}")
+        return None
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def hash_bands(phash):
+    """Split a 64-bit hash into (band, value) pairs for exact-match candidate lookups."""
+    value = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(band, (value >> (band * BAND_BITS)) & mask) for band in range(64 // BAND_BITS)]
+
+
+def _link_or_copy(src, dest):
+    """Hard-link src to dest, falling back to a copy on filesystems without links."""
+    tmp = dest + ".tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+
+class ImageStore:
+    """Content-addressed image store with a perceptual-hash index for near-duplicate lookups.
+
+    Album folders keep their usual file names, but each file is a hard link to the
+    single stored object for its bytes, so identical photos are kept on disk once.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def object_path(self, sha256, ext):
+        return os.path.join(self.root, sha256[:2], sha256 + ext)
+
+    @locked
+    def add(self, path, sha256=None):
+        """Store the file at path and turn it into a reference to the stored object. Returns the sha256."""
+        sha256 = sha256 or file_sha256(path)
+        row = self.conn.execute("SELECT path FROM objects WHERE sha256 = ?", (sha256,)).fetchone()
+        if row and os.path.exists(row["path"]):
+            if not os.path.samefile(row["path"], path):
+                _link_or_copy(row["path"], path)
+                logging.info(f"Deduplicated {path} -> {row['path']}")
+        else:
+            obj = self.object_path(sha256, os.path.splitext(path)[1].lower())
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            _link_or_copy(path, obj)
+            phash = dhash(obj)
+            self.conn.execute("INSERT OR REPLACE INTO objects (sha256, path, phash, size, created_at)"
+                              " VALUES (?, ?, ?, ?, ?)", (sha256, obj, phash, os.path.getsize(obj), time.time()))
+            if phash:
+                self.conn.executemany("INSERT OR IGNORE INTO phash_bands (band, value, sha256) VALUES (?, ?, ?)",
+                                      [(band, value, sha256) for band, value in hash_bands(phash)])
+        ref_path = os.path.abspath(path)
+        self.conn.execute("INSERT OR REPLACE INTO refs (ref_path, album_path, sha256) VALUES (?, ?, ?)",
+                          (ref_path, os.path.dirname(ref_path), sha256))
+        self.conn.commit()
+        return sha256
+
+    @locked
+    def sha_for(self, path):
+        """Content hash of a referenced album file, or None if the store has not seen it."""
+        row = self.conn.execute("SELECT sha256 FROM refs WHERE ref_path = ?", (os.path.abspath(path),)).fetchone()
+        return row["sha256"] if row else None
+
+    @locked
+    def phash_for(self, sha256):
+        row = self.conn.execute("SELECT phash FROM objects WHERE sha256 = ?", (sha256,)).fetchone()
+        return row["phash"] if row else None
+
+    @locked
+    def similar(self, phash, max_distance=DUPLICATE_DISTANCE):
+        """Return [(distance, sha256)] for stored images within max_distance of phash, closest first."""
+        candidates = set()
+        for band, value in hash_bands(phash):
+            rows = self.conn.execute("SELECT sha256 FROM phash_bands WHERE band = ? AND value = ?", (band, value))
+            candidates.update(r["sha256"] for r in rows)
+        matches = []
+        for sha256 in candidates:
+            other = self.phash_for(sha256)
+            if other:
+                distance = hamming(phash, other)
+                if distance <= max_distance:
+                    matches.append((distance, sha256))
+        return sorted(matches)
+
+    @locked
+    def album_hashes(self, album_path):
+        rows = self.conn.execute("SELECT sha256 FROM refs WHERE album_path = ?", (os.path.abspath(album_path),))
+        return [r["sha256"] for r in rows]
+
+    @locked
+    def albums_sharing(self, sha256, max_distance=DUPLICATE_DISTANCE):
+        """How many albums hold this image or a stored near-duplicate of it."""
+        matched = {sha256}
+        phash = self.phash_for(sha256)
+        if phash:
+            matched.update(sha for _, sha in self.similar(phash, max_distance))
+        placeholders = ",".join("?" * len(matched))
+        row = self.conn.execute(f"SELECT COUNT(DISTINCT album_path) AS n FROM refs WHERE sha256 IN ({placeholders})",
+                                list(matched)).fetchone()
+        return row["n"]
+
+    @locked
+    def flag_duplicate_album(self, album_path, ratio=DUPLICATE_ALBUM_RATIO):
+        """Flag album_path if most of its images match images of a single other album. Returns that album or None."""
+        album_path = os.path.abspath(album_path)
+        hashes = self.album_hashes(album_path)
+        if not hashes:
+            return None
+        votes = {}
+        for sha256 in hashes:
+            phash = self.phash_for(sha256)
+            matched = {sha256}
+            if phash:
+                matched.update(sha for _, sha in self.similar(phash))
+            others = set()
+            for sha in matched:
+                rows = self.conn.execute("SELECT album_path FROM refs WHERE sha256 = ? AND album_path != ?",
+                                         (sha, album_path))
+                others.update(r["album_path"] for r in rows)
+            for other in others:
+                votes[other] = votes.get(other, 0) + 1
+        if not votes:
+            return None
+        best, count = max(votes.items(), key=lambda item: item[1])
+        share = count / len(hashes)
+        if share < ratio:
+            return None
+        self.conn.execute("INSERT OR REPLACE INTO duplicate_albums (album_path, duplicate_of, ratio) VALUES (?, ?, ?)",
+                          (album_path, best, share))
+        self.conn.commit()
+        logging.info(f"Album {album_path} looks like a duplicate of {best} ({share:.0%} of images)")
+        return best
+
+    @locked
+    def duplicate_of(self, album_path):
+        row = self.conn.execute("SELECT duplicate_of FROM duplicate_albums WHERE album_path = ?",
+                                (os.path.abspath(album_path),)).fetchone()
+        return row["duplicate_of"] if row else None
+
+    @locked
+    def stage_result(self, sha256, stage):
+        """Result a pipeline stage stored for this image content, or None."""
+        row = self.conn.execute("SELECT result FROM stage_results WHERE sha256 = ? AND stage = ?",
+                                (sha256, stage)).fetchone()
+        return row["result"] if row else None
+
+    @locked
+    def find_stage_result(self, path, stage, max_distance=DUPLICATE_DISTANCE):
+        """Stage result for the image at path, or for a stored near-duplicate of it."""
+        sha256 = self.sha_for(path) or file_sha256(path)
+        result = self.stage_result(sha256, stage)
+        if result is not None:
+            return result
+        phash = self.phash_for(sha256) or dhash(path)
+        if not phash:
+            return None
+        for _, other in self.similar(phash, max_distance):
+            result = self.stage_result(other, stage)
+            if result is not None:
+                return result
+        return None
+
+    @locked
+    def save_stage_result(self, sha256, stage, result):
+        self.conn.execute("INSERT OR REPLACE INTO stage_results (sha256, stage, result, updated_at)"
+                          " VALUES (?, ?, ?, ?)", (sha256, stage, result, time.time()))
+        self.conn.commit()
+
+    @locked
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,112 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+
+from image_store import BAND_BITS, hash_bands, hamming
+from metrics import METRICS
+
+# ========== CONFIG ==========
+LENS_CACHE_PATH = "downloads/lens_cache.sqlite"
+MAX_DISTANCE = 6          # Hamming distance on 64-bit dHashes; must stay below 8 for the band lookup
+TTL_SECONDS = 30 * 24 * 3600
+# ============================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    phash TEXT PRIMARY KEY,
+    links TEXT,
+    name TEXT,
+    description TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS search_bands (
+    band INTEGER,
+    value INTEGER,
+    phash TEXT,
+    PRIMARY KEY (band, value, phash)
+);
+"""
+
+
+class LensCache:
+    """Reverse-image-search results keyed by perceptual hash, matched within a Hamming distance."""
+
+    def __init__(self, db_path=LENS_CACHE_PATH, max_distance=MAX_DISTANCE, ttl=TTL_SECONDS):
+        # Two hashes within distance d share an exact band only while d < number of bands (pigeonhole)
+        if max_distance >= 64 // BAND_BITS:
+            raise ValueError(f"max_distance {max_distance} is too large for the band lookup; "
+                             f"it must be below {64 // BAND_BITS}")
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.evict_expired()
+
+    def lookup(self, phash):
+        """Closest fresh entry within max_distance as {"links", "name", "description"}, or None."""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            candidates = set()
+            for band, value in hash_bands(phash):
+                rows = self.conn.execute("SELECT phash FROM search_bands WHERE band = ? AND value = ?", (band, value))
+                candidates.update(r["phash"] for r in rows)
+            best = None
+            for other in candidates:
+                distance = hamming(phash, other)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    row = self.conn.execute("SELECT * FROM searches WHERE phash = ? AND updated_at >= ?",
+                                            (other, cutoff)).fetchone()
+                    if row:
+                        best = (distance, row)
+            if best is None:
+                self.misses += 1
+                METRICS.incr("cache_misses", cache="lens")
+                return None
+            self.hits += 1
+            METRICS.incr("cache_hits", cache="lens")
+            row = best[1]
+            return {"links": json.loads(row["links"]) if row["links"] is not None else None,
+                    "name": row["name"], "description": row["description"]}
+
+    def _upsert(self, phash, **fields):
+        with self.lock:
+            exists = self.conn.execute("SELECT 1 FROM searches WHERE phash = ?", (phash,)).fetchone()
+            if not exists:
+                self.conn.execute("INSERT INTO searches (phash, updated_at) VALUES (?, ?)", (phash, time.time()))
+                self.conn.executemany("INSERT OR IGNORE INTO search_bands (band, value, phash) VALUES (?, ?, ?)",
+                                      [(band, value, phash) for band, value in hash_bands(phash)])
+            for column, value in fields.items():
+                self.conn.execute(f"UPDATE searches SET {column} = ?, updated_at = ? WHERE phash = ?",
+                                  (value, time.time(), phash))
+            self.conn.commit()
+
+    def store_links(self, phash, links):
+        """Remember the ranked candidate links a Lens search returned for this image."""
+        self._upsert(phash, links=json.dumps(links))
+
+    def store_result(self, phash, name, description):
+        """Remember the (name, description) finally extracted for this image."""
+        self._upsert(phash, name=name, description=description)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = [r["phash"] for r in self.conn.execute("SELECT phash FROM searches WHERE updated_at < ?",
+                                                             (cutoff,))]
+            for phash in expired:
+                self.conn.execute("DELETE FROM searches WHERE phash = ?", (phash,))
+                self.conn.execute("DELETE FROM search_bands WHERE phash = ?", (phash,))
+            self.conn.commit()
+        return len(expired)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,243 @@
+import os
+import io
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import TokenBucket
+from metrics import METRICS
+
+# ========== CONFIG ==========
+API_KEY = "Your API Key"  # replace with your actual key
+BASE_URL = None           # e.g. "http://127.0.0.1:8000/v1" to run against a local stub
+MODEL = "gpt-4o"
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+WORKERS = 4                   # Rewrites in flight at once
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 30000     # Prompt estimate + max_tokens are reserved before each request
+BATCH_MODE = False            # Submit whole folders through the Batch API instead of one request each
+BATCH_POLL_SECONDS = 30
+CACHE_PATH = "downloads/llm_cache.sqlite"
+# ============================
+
+SYSTEM_PROMPT = "You are a professional luxury product copywriter."
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    temperature REAL,
+    content TEXT,
+    created_at REAL
+);
+"""
+
+
+def build_prompt(context_details, original_name, original_desc, category):
+    return (
+        f"You are an expert fashion product copywriter.\n\n"
+        f"Rewrite the product name and description for a high-end online store, using simple, sophisticated, and inviting language.\n\n"
+        f"Guidelines:\n"
+        f"- Create a short, catchy product name (max 7 words).\n"
+        f"- Write a soft, smooth, story-like description in 3 to 4 lines.\n"
+        f"- Mention material or dimensions if available, in a natural way.\n"
+        f"- Do not mention color.\n"
+        f"- Highlight comfort, style, or daily use, so it feels relatable.\n"
+        f"- Do not mention store names, disclaimers, or brand name in the name.\n"
+        f"- Do not invent new details.\n\n"
+        f"Context Details:\n{context_details}\n\n"
+        f"Original Product Name: {original_name}\n"
+        f"Original Description: {original_desc}\n\n"
+        f"Return the new product name first, then the new description, separated by a line break.\n"
+    )
+
+
+def cache_key(messages, model, temperature):
+    """Stable hash of everything that determines the completion."""
+    payload = json.dumps({"model": model, "temperature": temperature, "messages": messages}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(messages, max_tokens=MAX_TOKENS):
+    # ~4 characters per token is close enough for budgeting
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+
+def split_name_and_description(text, original_name, original_desc):
+    lines = text.strip().split("\n", 1)
+    if len(lines) >= 2:
+        return lines[0].strip(), lines[1].strip()
+    return original_name, original_desc
+
+
+class ResponseCache:
+    """Completions keyed by cache_key, so re-runs never pay twice for the same prompt."""
+
+    def __init__(self, db_path=CACHE_PATH):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, model, temperature, content):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, model, temperature, content, created_at) "
+                              "VALUES (?, ?, ?, ?, ?)", (key, model, temperature, content, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Rewriter:
+    """Background LLM rewriting with bounded concurrency, RPM/token budgets and a response cache."""
+
+    def __init__(self, cache=None, client=None, workers=WORKERS, model=MODEL, temperature=TEMPERATURE,
+                 rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE, base_url=BASE_URL):
+        self.cache = cache if cache is not None else ResponseCache()
+        self.model = model
+        self.temperature = temperature
+        self.base_url = base_url
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.requests = TokenBucket(rpm / 60.0, max(1, rpm // 10), rpm / 60.0, rpm / 60.0)
+        self.tokens = TokenBucket(tpm / 60.0, max(MAX_TOKENS * 2, tpm // 10), tpm / 60.0, tpm / 60.0)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rewrite")
+        self.stats = {"cached": 0, "requested": 0, "failed": 0, "tokens": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=API_KEY, base_url=self.base_url)
+            return self._client
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _messages(self, context_details, original_name, original_desc, category):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_prompt(context_details, original_name, original_desc, category)},
+        ]
+
+    def _complete(self, messages):
+        key = cache_key(messages, self.model, self.temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("cached")
+            METRICS.incr("cache_hits", cache="llm")
+            return cached
+        METRICS.incr("cache_misses", cache="llm")
+        with METRICS.span("llm_budget_wait"):
+            self.requests.acquire()
+            self.tokens.acquire(estimate_tokens(messages))
+        with METRICS.span("openai_request", model=self.model):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=MAX_TOKENS
+            )
+        content = response.choices[0].message.content.strip()
+        self._count("requested")
+        if getattr(response, "usage", None) is not None:
+            self._count("tokens", response.usage.total_tokens or 0)
+        self.cache.put(key, self.model, self.temperature, content)
+        return content
+
+    def rewrite(self, context_details, original_name, original_desc, category):
+        """Blocking rewrite; returns the originals if the request fails."""
+        messages = self._messages(context_details, original_name, original_desc, category)
+        try:
+            content = self._complete(messages)
+        except Exception as e:
+            self._count("failed")
+            print(f"⚠️ OpenAI error: {e}")
+            logging.error(f"LLM rewrite failed for {original_name!r}: {e}")
+            return original_name, original_desc
+        return split_name_and_description(content, original_name, original_desc)
+
+    def submit(self, context_details, original_name, original_desc, category):
+        """Queue a rewrite on the worker pool; the Future resolves to (name, description)."""
+        return self.executor.submit(self.rewrite, context_details, original_name, original_desc, category)
+
+    def rewrite_batch(self, jobs):
+        """Rewrite many (context, name, desc, category) jobs through the Batch API.
+
+        Cached prompts are answered locally; the rest go out as one batch file. Returns results
+        in job order; jobs the batch could not answer keep their original name and description.
+        """
+        results = [(job[1], job[2]) for job in jobs]
+        pending = {}
+        for i, job in enumerate(jobs):
+            messages = self._messages(*job)
+            cached = self.cache.get(cache_key(messages, self.model, self.temperature))
+            if cached is not None:
+                self._count("cached")
+                results[i] = split_name_and_description(cached, job[1], job[2])
+            else:
+                pending[str(i)] = messages
+        if not pending:
+            return results
+
+        lines = [json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                             "body": {"model": self.model, "messages": messages,
+                                      "temperature": self.temperature, "max_tokens": MAX_TOKENS}})
+                 for custom_id, messages in pending.items()]
+        try:
+            batch_file = self.client.files.create(file=("rewrites.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+                                                  purpose="batch")
+            batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                               completion_window="24h")
+            print(f"🧾 Submitted batch {batch.id} with {len(pending)} rewrites")
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(BATCH_POLL_SECONDS)
+                batch = self.client.batches.retrieve(batch.id)
+            if batch.status != "completed" or not batch.output_file_id:
+                raise RuntimeError(f"batch {batch.id} ended as {batch.status}")
+            output = self.client.files.content(batch.output_file_id).text
+        except Exception as e:
+            self._count("failed", len(pending))
+            print(f"⚠️ OpenAI batch error: {e}")
+            logging.error(f"LLM batch rewrite failed: {e}")
+            return results
+
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            messages = pending.get(item.get("custom_id"))
+            body = (item.get("response") or {}).get("body") or {}
+            if messages is None or not body.get("choices"):
+                continue
+            content = body["choices"][0]["message"]["content"].strip()
+            self.cache.put(cache_key(messages, self.model, self.temperature), self.model, self.temperature, content)
+            self._count("requested")
+            self._count("tokens", (body.get("usage") or {}).get("total_tokens") or 0)
+            job = jobs[int(item["custom_id"])]
+            results[int(item["custom_id"])] = split_name_and_description(content, job[1], job[2])
+        return results
+
+    def close(self):
+        """Wait for queued rewrites, then release the pool and the cache."""
+        self.executor.shutdown(wait=True)
+        self.cache.close()
+        s = self.stats
+        print(f"✍️ Rewrites: {s['requested']} requested, {s['cached']} cached, {s['failed']} failed, "
+              f"{s['tokens']} tokens")
@@ -0,0 +1,84 @@
+import os
+import time
+import sqlite3
+import threading
+
+from db import locked
+from image_store import file_sha256
+
+# ========== CONFIG ==========
+REGISTRY_PATH = "downloads/media_registry.sqlite"
+EXCLUDE_FILLER = False     # Leave shared filler shots (boxes, dust bags, size charts) out of products
+FILLER_MIN_ALBUMS = 5      # An image seen in at least this many albums counts as filler
+FILLER_DISTANCE = 4        # dHash distance at which two photos count as the same shot
+# ============================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    shop TEXT,
+    sha256 TEXT,
+    media_id TEXT,
+    album TEXT,
+    uses INTEGER,
+    created_at REAL,
+    PRIMARY KEY (shop, sha256)
+);
+"""
+
+
+class MediaRegistry:
+    """Shopify media IDs of images already uploaded to a shop, keyed by the uploaded file's sha256."""
+
+    def __init__(self, shop, db_path=REGISTRY_PATH):
+        self.shop = shop
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    @locked
+    def lookup(self, sha256):
+        row = self.conn.execute("SELECT media_id FROM media WHERE shop = ? AND sha256 = ?",
+                                (self.shop, sha256)).fetchone()
+        return row["media_id"] if row else None
+
+    @locked
+    def record(self, sha256, media_id, album_path):
+        self.conn.execute("INSERT OR REPLACE INTO media (shop, sha256, media_id, album, uses, created_at) "
+                          "VALUES (?, ?, ?, ?, 1, ?)",
+                          (self.shop, sha256, media_id, os.path.basename(album_path), time.time()))
+        self.conn.commit()
+
+    @locked
+    def reused(self, sha256):
+        self.conn.execute("UPDATE media SET uses = uses + 1 WHERE shop = ? AND sha256 = ?", (self.shop, sha256))
+        self.conn.commit()
+
+    @locked
+    def forget(self, media_ids):
+        """Drop media that no longer exist in the shop (deleted from the admin), so they are uploaded again."""
+        self.conn.executemany("DELETE FROM media WHERE shop = ? AND media_id = ?",
+                              [(self.shop, media_id) for media_id in media_ids])
+        self.conn.commit()
+
+    @locked
+    def close(self):
+        self.conn.close()
+
+
+def filler_images(store, album_path, names, min_albums=FILLER_MIN_ALBUMS, max_distance=FILLER_DISTANCE):
+    """Names of an album's images that also appear (or nearly) in at least min_albums albums of the image store.
+
+    Never returns every image, so a product always keeps at least one photo.
+    """
+    filler = set()
+    for name in names:
+        path = os.path.join(album_path, name)
+        if not os.path.isfile(path):
+            continue
+        sha256 = store.sha_for(path) or file_sha256(path)
+        if store.albums_sharing(sha256, max_distance) >= min_albums:
+            filler.add(name)
+    return filler if len(filler) < len(names) else set()
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import argparse
+import threading
+import functools
+from contextlib import contextmanager
+from collections import defaultdict
+
+# ========== CONFIG ==========
+TRACE_DIR = "downloads/_runs"          # One <run id>.jsonl trace per run
+PROM_FILE = "downloads/_runs/pipeline.prom"   # Overwritten at the end of every run (node_exporter textfile)
+# ============================
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _labels(labels):
+    return ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in sorted(labels.items()))
+
+
+class Metrics:
+    """Timing spans and counters for one run, written as a JSONL trace and a Prometheus textfile."""
+
+    def __init__(self, trace_dir=TRACE_DIR, prom_file=PROM_FILE):
+        self.trace_dir = trace_dir
+        self.prom_file = prom_file
+        self.run_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.samples = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+        self._trace = None
+
+    def _write(self, record):
+        # Called with the lock held; the trace is only created once something is recorded
+        if self._trace is None:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            self._trace = open(os.path.join(self.trace_dir, f"{self.run_id}.jsonl"), "a", encoding="utf-8")
+            atexit.register(self.finish)
+        self._trace.write(json.dumps(record) + "\n")
+        self._trace.flush()
+
+    @contextmanager
+    def span(self, stage, album=None, **attrs):
+        """Time the enclosed block as one span of `stage`, optionally attributed to an album."""
+        started = time.time()
+        clock = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            seconds = time.perf_counter() - clock
+            record = {"run": self.run_id, "ts": started, "stage": stage, "seconds": round(seconds, 6), "ok": ok}
+            if album is not None:
+                record["album"] = album
+            record.update(attrs)
+            with self.lock:
+                self.samples[stage].append(seconds)
+                self._write(record)
+
+    def timed(self, stage, album=None):
+        """Decorator form of span(); album names the argument that identifies the album, if any."""
+        def decorate(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                album_value = None
+                if album is not None:
+                    bound = signature.bind_partial(*args, **kwargs)
+                    album_value = bound.arguments.get(album)
+                    if isinstance(album_value, dict):  # Scraper albums are {"title", "url"}
+                        album_value = album_value.get("title")
+                    elif isinstance(album_value, str):  # Album folders are reported by name
+                        album_value = os.path.basename(os.path.normpath(album_value))
+                with self.span(stage, album=album_value):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def incr(self, name, amount=1, **labels):
+        """Add to a counter such as retries or cache hits; labels split it (e.g. host="yupoo.com")."""
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def prometheus(self):
+        lines = ["# HELP pipeline_stage_seconds Wall time per stage span in the last run",
+                 "# TYPE pipeline_stage_seconds summary"]
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+            counters = dict(self.counters)
+        for stage, values in sorted(samples.items()):
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'pipeline_stage_seconds{{stage="{stage}",quantile="{q}"}} {percentile(values, q * 100):.6f}')
+            lines.append(f'pipeline_stage_seconds_sum{{stage="{stage}"}} {sum(values):.6f}')
+            lines.append(f'pipeline_stage_seconds_count{{stage="{stage}"}} {len(values)}')
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE pipeline_{name}_total counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    label_text = _labels(dict(labels))
+                    lines.append(f"pipeline_{name}_total{{{label_text}}} {value}" if label_text
+                                 else f"pipeline_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def finish(self):
+        """Append the counters to the trace and write the Prometheus textfile. Safe to call twice."""
+        with self.lock:
+            if self._trace is None or self._trace.closed:
+                return
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            self._write({"run": self.run_id, "ts": time.time(), "counters": counters})
+            self._trace.close()
+        os.makedirs(os.path.dirname(self.prom_file) or ".", exist_ok=True)
+        tmp = self.prom_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, self.prom_file)
+
+
+# Shared by the scraper, the enrichment stage and the uploader
+METRICS = Metrics()
+
+
+def latest_trace(trace_dir=TRACE_DIR):
+    if not os.path.isdir(trace_dir):
+        return None
+    traces = [os.path.join(trace_dir, f) for f in os.listdir(trace_dir) if f.endswith(".jsonl")]
+    return max(traces, key=os.path.getmtime) if traces else None
+
+
+def summarize(paths, slowest=10):
+    """Print p50/p95 per stage, the counters and the slowest albums of one or more traces."""
+    samples = defaultdict(list)
+    failures = defaultdict(int)
+    albums = defaultdict(float)
+    counters = defaultdict(int)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if "counters" in record:
+                    for c in record["counters"]:
+                        counters[(c["name"], _labels(c["labels"]))] += c["value"]
+                    continue
+                samples[record["stage"]].append(record["seconds"])
+                failures[record["stage"]] += not record["ok"]
+                if record.get("album"):
+                    albums[record["album"]] += record["seconds"]
+
+    print(f"{'stage':<28} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'total s':>10} {'failed':>7}")
+    for stage, values in sorted(samples.items(), key=lambda item: -sum(item[1])):
+        print(f"{stage:<28} {len(values):>6} {percentile(values, 50) * 1000:>10.1f} "
+              f"{percentile(values, 95) * 1000:>10.1f} {sum(values):>10.1f} {failures[stage]:>7}")
+    if counters:
+        print("\nCounters:")
+        for (name, labels), value in sorted(counters.items()):
+            print(f"  {name}{{{labels}}} {value}" if labels else f"  {name} {value}")
+    if albums:
+        print("\nSlowest albums:")
+        for album, seconds in sorted(albums.items(), key=lambda item: -item[1])[:slowest]:
+            print(f"  {seconds:8.1f}s  {album}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize pipeline run traces.")
+    parser.add_argument("command", choices=["summary"])
+    parser.add_argument("traces", nargs="*", help="trace files (default: the latest run)")
+    parser.add_argument("--slowest", type=int, default=10)
+    args = parser.parse_args(argv)
+    paths = args.traces or [p for p in [latest_trace()] if p]
+    if not paths:
+        print(f"[!] No traces in {TRACE_DIR}")
+        return 1
+    summarize(paths, args.slowest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from metrics import METRICS
+
+# ========== CONFIG ==========
+PAGE_CACHE_PATH = "downloads/page_cache.sqlite"
+HIT_TTL_SECONDS = 14 * 24 * 3600    # Extracted product details
+MISS_TTL_SECONDS = 3 * 24 * 3600    # Pages that gave nothing usable (4xx, not HTML, no valid details)
+TRANSIENT_TTL_SECONDS = 3600        # Server errors (5xx), which usually clear up on their own
+# ============================
+
+# Query parameters that never change the page content
+TRACKING_PREFIX = "utm_"
+TRACKING_PARAMS = {"gclid", "fbclid", "srsltid", "_ga", "ref", "mc_cid", "mc_eid"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    quality INTEGER,
+    reason TEXT,
+    updated_at REAL
+);
+"""
+
+
+def is_transient(reason):
+    return bool(reason) and reason.startswith("http_5")
+
+
+def normalize_url(url):
+    """Canonical form of a product URL: lowercase host, no fragment, tracking parameters or trailing slash."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not (k.lower().startswith(TRACKING_PREFIX) or k.lower() in TRACKING_PARAMS))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower() or "https", host, path, urlencode(query), ""))
+
+
+class PageCache:
+    """Extraction results per normalized product URL, including negative results with a reason."""
+
+    def __init__(self, db_path=PAGE_CACHE_PATH, hit_ttl=HIT_TTL_SECONDS, miss_ttl=MISS_TTL_SECONDS,
+                 transient_ttl=TRANSIENT_TTL_SECONDS):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.transient_ttl = transient_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.evict_expired()
+
+    def _fresh(self, row, now):
+        if not row["reason"]:
+            ttl = self.hit_ttl
+        else:
+            ttl = self.transient_ttl if is_transient(row["reason"]) else self.miss_ttl
+        return row["updated_at"] >= now - ttl
+
+    def get(self, url):
+        """Fresh entry as {"name", "desc", "quality", "reason"}, or None. reason is set for negative entries."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM pages WHERE url = ?", (normalize_url(url),)).fetchone()
+            if row is None or not self._fresh(row, time.time()):
+                self.misses += 1
+                METRICS.incr("cache_misses", cache="page")
+                return None
+            self.hits += 1
+            METRICS.incr("cache_hits", cache="page")
+        return {"name": row["name"], "desc": row["description"], "quality": row["quality"], "reason": row["reason"]}
+
+    def _put(self, url, name, description, quality, reason):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO pages (url, name, description, quality, reason, updated_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (normalize_url(url), name, description, quality, reason, time.time()))
+            self.conn.commit()
+
+    def put_hit(self, url, name, description, quality=0):
+        self._put(url, name, description, quality, None)
+
+    def put_miss(self, url, reason):
+        self._put(url, None, None, 0, reason)
+
+    def evict_expired(self):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM pages WHERE (reason IS NULL AND updated_at < ?) "
+                                       "OR (reason IS NOT NULL AND updated_at < ?) "
+                                       "OR (reason LIKE 'http_5%' AND updated_at < ?)",
+                                       (now - self.hit_ttl, now - self.miss_ttl, now - self.transient_ttl))
+            self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
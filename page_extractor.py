@@ -0,0 +1,217 @@
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import downloader
+from html_snapshot import parse_html
+from rate_limiter import LIMITER
+from metrics import METRICS
+
+# ========== CONFIG ==========
+TOP_N = 8                # Candidate pages fetched concurrently per batch
+MIN_VISIBLE_TEXT = 200   # Pages with less text than this (and no metadata) are assumed to need JavaScript
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+# ============================
+
+DETAIL_KEYWORDS = ["material", "composition", "dimension", "size", "measurement", "cm", "inch", "height", "width", "depth"]
+JS_CHALLENGE_MARKERS = ["just a moment", "enable javascript", "checking your browser", "please turn javascript on"]
+
+# Result quality, highest wins before the link score is considered
+JSON_LD, META, TITLE_ONLY = 3, 2, 1
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def is_valid_text(text):
+    if not text or len(text.strip()) < 5:
+        return False
+    lower_text = text.lower()
+    if "just a moment" in lower_text:
+        return False
+    spam_keywords = ["paypal", "bonifico", "spedizione", "tracciabile", "contatti", "whatsapp", "imballaggio"]
+    if any(spam in lower_text for spam in spam_keywords):
+        return False
+    return True
+
+
+def contains_error_messages(text):
+    lower_text = text.lower()
+    error_keywords = ["this item does not exist", "we have detected unusual activity", "access denied", "this site can’t be reached", "this site cannot be reached", "page isn’t working"]
+    return any(keyword in lower_text for keyword in error_keywords)
+
+
+def shared_session():
+    """Pooled HTTP session reused for every candidate page fetch."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = downloader.build_session(HEADERS, pool_size=TOP_N * 2)
+        return _session
+
+
+def _json_ld_items(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from _json_ld_items(item)
+    elif isinstance(data, dict):
+        yield data
+        if "@graph" in data:
+            yield from _json_ld_items(data["@graph"])
+
+
+def _is_product(item):
+    kind = item.get("@type", "")
+    kinds = kind if isinstance(kind, list) else [kind]
+    return any(isinstance(k, str) and k.lower() == "product" for k in kinds)
+
+
+def product_from_json_ld(blocks):
+    """First valid (name, description) from application/ld+json Product blocks, or None.
+
+    Returns False if a Product block carries an error message, like the browser path does.
+    """
+    for raw in blocks:
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        for item in _json_ld_items(data):
+            if not _is_product(item):
+                continue
+            name = item.get("name") or ""
+            desc = item.get("description") or ""
+            if not isinstance(name, str) or not isinstance(desc, str):
+                continue
+            if contains_error_messages(name + desc):
+                return False
+            if is_valid_text(name) and is_valid_text(desc):
+                return name.strip(), desc.strip()
+    return None
+
+
+def extract_from_html(html, rendered=False):
+    """Run the product-detail extraction on raw HTML.
+
+    Returns {"name", "desc", "quality", "needs_js", "reason"}; name and desc are None when nothing
+    usable was found, with reason saying why, and needs_js flags pages that look client-rendered
+    or challenge-protected.
+    Pass rendered=True for a browser's page_source, which has already run its JavaScript.
+    """
+    result = {"name": None, "desc": None, "quality": 0, "needs_js": False, "reason": "error_message"}
+    snapshot = parse_html(html)
+    lower_html = (html or "").lower()
+    if contains_error_messages(snapshot.title) or contains_error_messages(lower_html):
+        return result
+
+    found = product_from_json_ld(snapshot.json_ld)
+    if found is False:
+        return result
+    if found:
+        result.update(name=found[0], desc=found[1], quality=JSON_LD, reason=None)
+        return result
+
+    visible_text = snapshot.texts("li", "p", "h1")
+    if not rendered and (any(marker in lower_html for marker in JS_CHALLENGE_MARKERS) or (
+            "og:title" not in snapshot.meta and sum(len(t) for t in visible_text) < MIN_VISIBLE_TEXT)):
+        result.update(needs_js=True, reason="needs_js")
+        return result
+
+    title = snapshot.meta.get("og:title")
+    desc = snapshot.meta.get("description")
+    quality = META if title and desc else TITLE_ONLY
+    title = title or snapshot.title or "Unknown Product"
+    desc = desc or "No description available"
+    if contains_error_messages(title + desc):
+        return result
+
+    extra_details = []
+    for text in snapshot.texts("li", "p"):
+        if any(keyword in text.lower() for keyword in DETAIL_KEYWORDS) and text not in extra_details:
+            extra_details.append(text)
+    if extra_details:
+        desc = desc + "\n" + "\n".join(extra_details)
+
+    if is_valid_text(title) and is_valid_text(desc):
+        result.update(name=title.strip(), desc=desc.strip(), quality=quality, reason=None)
+    else:
+        result["reason"] = "invalid_text"
+    return result
+
+
+@METRICS.timed("extract_http")
+def fetch_and_extract(url, session=None):
+    """Fetch one candidate page over HTTP and extract from it.
+
+    Adds "url", "status", "seconds" and "blocked" (answered 403/429/503) to the result.
+    """
+    session = session or shared_session()
+    started = time.monotonic()
+    try:
+        response = LIMITER.call(url, lambda: session.get(url, timeout=15))
+    except Exception as e:
+        logging.info(f"HTTP fetch failed for {url}: {e}")
+        return {"url": url, "status": None, "name": None, "desc": None, "quality": 0, "needs_js": True,
+                "reason": "fetch_error", "blocked": False, "seconds": time.monotonic() - started}
+    if response.status_code != 200 or "html" not in response.headers.get("Content-Type", "html"):
+        # Bot walls answer 403/429/503; a real browser may still get through
+        blocked = response.status_code in (403, 429, 503)
+        return {"url": url, "status": response.status_code, "name": None, "desc": None, "quality": 0,
+                "needs_js": blocked, "blocked": blocked,
+                "reason": f"http_{response.status_code}" if response.status_code != 200 else "not_html",
+                "seconds": time.monotonic() - started}
+    result = extract_from_html(response.text)
+    result.update(url=url, status=response.status_code, blocked=False, seconds=time.monotonic() - started)
+    return result
+
+
+@METRICS.timed("extract_candidates")
+def extract_candidates(urls, score=None, session=None, top_n=TOP_N, page_cache=None, domain_stats=None):
+    """Fetch candidate pages concurrently, top_n at a time, and return (best result, results needing a browser).
+
+    The best result maximises (quality, score(url)); batches stop once one yields a result.
+    With a page_cache, cached pages are answered without a request, known-bad pages are skipped,
+    and every definite outcome is recorded. With domain_stats, every fetch that decided its page is
+    counted towards its domain's success, block rate and latency. Pages left for the browser are
+    recorded in neither; the browser retry records them with the HTTP "blocked" and "seconds".
+    """
+    score = score or (lambda url: 0)
+    needs_browser = []
+    for start in range(0, len(urls), top_n):
+        batch = urls[start:start + top_n]
+        results = []
+        if page_cache is not None:
+            remaining = []
+            for url in batch:
+                cached = page_cache.get(url)
+                if cached is None:
+                    remaining.append(url)
+                elif not cached["reason"]:
+                    results.append({"url": url, "status": None, "name": cached["name"], "desc": cached["desc"],
+                                    "quality": cached["quality"], "needs_js": False, "reason": None,
+                                    "blocked": False})
+            batch = remaining
+        if batch:
+            with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+                fetched = list(pool.map(lambda url: fetch_and_extract(url, session), batch))
+            for r in fetched:
+                if r["needs_js"]:
+                    continue
+                if domain_stats is not None:
+                    domain_stats.record(r["url"], r["name"] and r["desc"], seconds=r["seconds"])
+                if page_cache is not None:
+                    if r["name"] and r["desc"]:
+                        page_cache.put_hit(r["url"], r["name"], r["desc"], r["quality"])
+                    else:
+                        page_cache.put_miss(r["url"], r["reason"])
+            results.extend(fetched)
+        needs_browser.extend(r for r in results if r["needs_js"])
+        hits = [r for r in results if r["name"] and r["desc"]]
+        if hits:
+            return max(hits, key=lambda r: (r["quality"], score(r["url"]))), needs_browser
+    return None, needs_browser
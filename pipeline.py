@@ -0,0 +1,321 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import scraper
+import downloader
+import shopify_api
+import shopify_uploader
+import image_search_description_generator as enricher
+from crawl_index import CrawlIndex
+from image_store import ImageStore
+from lens_cache import LensCache
+from page_cache import PageCache
+from domain_ranker import DomainStats
+from catalog import CatalogSet, REWRITTEN, UPLOADED
+from upload_ledger import LedgerSet, FAILED
+from media_registry import MediaRegistry
+from llm_rewriter import Rewriter
+from driver_pool import DriverPool
+from image_preprocess import album_derivatives, WORKERS as PREPROCESS_PROCESSES
+import work_queue
+from work_queue import WorkQueue, run_worker
+
+# ========== CONFIG ==========
+QUEUE_SIZE = 8   # Items buffered between two stages before the upstream stage blocks
+STAGE_WORKERS = {
+    "download": 4,
+    "preprocess": 2,  # Threads feeding the shared process pool
+    "lens": 2,      # One pooled browser per worker
+    "rewrite": 4,
+    "upload": 8,    # Admin API uploads, paced by the GraphQL cost bucket (browser mode always uses 1)
+}
+UPLOAD = True
+UPLOAD_MODE = "api"   # "api": Admin API with staged media; "browser": the Selenium admin form
+QUEUE_STAGES = ["crawl", "download", "enrich", "rewrite", "upload"]
+QUEUE_WORKERS = {"crawl": 1, "download": 4, "enrich": 2, "rewrite": 4, "upload": 8}   # Threads per stage on a node
+# ============================
+
+_STOP = object()
+
+
+class Stage:
+    """One pipeline step: `workers` threads pull from an inbox and push results to the next stage.
+
+    func returns the item for the next stage, or None to drop it. The inbox is bounded,
+    so a slow stage blocks its upstream instead of letting work pile up in memory.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.stats = {"done": 0, "dropped": 0, "failed": 0, "busy_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _work(self, outbox):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f"[!] {self.name} failed: {e}")
+                logging.error(f"Pipeline stage {self.name} failed on {item!r}: {e}")
+                self._count("failed")
+                continue
+            finally:
+                self._count("busy_seconds", time.perf_counter() - started)
+            if result is None:
+                self._count("dropped")
+                continue
+            self._count("done")
+            if outbox is not None:
+                outbox.put(result)
+
+
+def run_pipeline(source, stages):
+    """Feed items from source through stages concurrently and return once every stage has drained."""
+    started = time.perf_counter()
+    groups = []
+    for i, stage in enumerate(stages):
+        outbox = stages[i + 1].inbox if i + 1 < len(stages) else None
+        threads = [threading.Thread(target=stage._work, args=(outbox,), name=f"{stage.name}-{n}", daemon=True)
+                   for n in range(stage.workers)]
+        for t in threads:
+            t.start()
+        groups.append(threads)
+
+    try:
+        for item in source:
+            stages[0].inbox.put(item)
+    finally:
+        # Shut stages down in order so every in-flight item reaches the end, even if the source failed
+        for stage, threads in zip(stages, groups):
+            for _ in threads:
+                stage.inbox.put(_STOP)
+            for t in threads:
+                t.join()
+
+    elapsed = time.perf_counter() - started
+    for stage in stages:
+        s = stage.stats
+        print(f"[✓] {stage.name}: {s['done']} done, {s['dropped']} skipped, {s['failed']} failed, "
+              f"{s['busy_seconds']:.1f}s busy")
+    print(f"[✓] Pipeline finished in {elapsed:.1f}s")
+    return {stage.name: dict(stage.stats) for stage in stages}
+
+
+class PipelineWork:
+    """Shared resources and the per-album work of each stage, for the in-process pipeline and queue workers.
+
+    stages limits what is opened to what those stages need, so a download-only worker never starts the
+    manually logged-in upload browser.
+    """
+
+    def __init__(self, stages=None):
+        serves = lambda stage: stages is None or stage in stages
+        self.session = downloader.build_session(scraper.HEADERS,
+                                                pool_size=downloader.MAX_WORKERS * STAGE_WORKERS["download"])
+        self.index = CrawlIndex()
+        self.store = ImageStore()
+        self.lens_cache = LensCache()
+        self.page_cache = PageCache()
+        self.domain_stats = DomainStats()
+        self.rewriter = Rewriter(workers=STAGE_WORKERS["rewrite"])
+        self.catalogs = CatalogSet()
+        self.ledgers = LedgerSet()
+        self.crawl_pool = DriverPool(scraper.chrome_options, size=scraper.BROWSER_POOL_SIZE)
+        self.lens_pool = DriverPool(enricher.chrome_options, size=STAGE_WORKERS["lens"], headless=enricher.HEADLESS)
+        uploads = UPLOAD and serves("upload")
+        self.upload_driver = shopify_uploader.setup_driver() if uploads and UPLOAD_MODE == "browser" else None
+        self.registry = MediaRegistry(shopify_api.SHOP_DOMAIN) if uploads and UPLOAD_MODE == "api" else None
+        self.api = shopify_api.AdminAPI(registry=self.registry) if self.registry is not None else None
+        self.processes = ProcessPoolExecutor(max_workers=PREPROCESS_PROCESSES)
+
+    def list_albums(self, category_url):
+        """(category, [(category_url, category, album)]); category is None if it could not be listed."""
+        category, found = scraper.list_albums(category_url, self.session, self.crawl_pool)
+        return category, [(category_url, category, album) for album in found]
+
+    def download(self, task):
+        category_url, category, album = task
+        album_path, status = scraper.process_album(album, category, category_url, self.session, self.index,
+                                                   self.store, self.crawl_pool)
+        # Unchanged albums only go downstream if a previous run never finished them
+        if status == "unchanged" and os.path.isdir(album_path):
+            product = self.catalogs.for_album(album_path).product(album_path)
+            if product and product["status"] in (REWRITTEN, UPLOADED):
+                return None
+        return album_path if os.path.isdir(album_path) else None
+
+    def preprocess(self, album_path):
+        album_derivatives(album_path, self.processes)
+        return album_path
+
+    def lens(self, album_path):
+        return enricher.lookup_album_details(self.lens_pool, self.store, self.catalogs.for_album(album_path),
+                                             os.path.dirname(album_path), album_path, self.lens_cache,
+                                             self.page_cache, self.domain_stats)
+
+    def rewrite(self, found):
+        return enricher.rewrite_album_details(self.catalogs.for_album(found[0]), *found, rewriter=self.rewriter)
+
+    def upload(self, album_path):
+        catalog = self.catalogs.for_album(album_path)
+        ledger = self.ledgers.for_album(album_path)
+        product = catalog.product(album_path)
+        if product is None:
+            return None
+        content_hash = ledger.content_hash(album_path, product)
+        needed, reason = ledger.needs_upload(album_path, content_hash)
+        if not needed:
+            return None
+        if self.api is not None:
+            return album_path if shopify_api.upload_with_ledger(self.api, ledger, catalog, album_path, product,
+                                                                content_hash, self.store) else None
+        return album_path if shopify_uploader.upload_with_ledger(self.upload_driver, ledger, catalog, album_path,
+                                                                 product, content_hash, self.store) else None
+
+    def close(self):
+        self.processes.shutdown()
+        self.crawl_pool.close()
+        self.lens_pool.close()
+        if self.upload_driver is not None:
+            self.upload_driver.quit()
+        self.index.close()
+        self.store.close()
+        self.lens_cache.close()
+        self.page_cache.close()
+        self.domain_stats.close()
+        self.rewriter.close()
+        self.ledgers.close()
+        if self.registry is not None:
+            self.registry.close()
+        self.catalogs.close()
+
+
+def queue_handlers(work):
+    """Queue stage -> handler(payload) returning follow-up jobs [(stage, key, payload)].
+
+    Preprocessing runs inside the enrich job, since derivatives are files on the node that uses them.
+    Payloads are JSON, so tuples travel as lists.
+    """
+    def crawl(category_url):
+        category, tasks = work.list_albums(category_url)
+        if category is None:
+            raise RuntimeError(f"could not list category {category_url}")
+        return [("download", album["url"], [url, category, album]) for url, category, album in tasks]
+
+    def download(task):
+        album_path = work.download(tuple(task))
+        return [("enrich", album_path, album_path)] if album_path else []
+
+    def enrich(album_path):
+        found = work.lens(work.preprocess(album_path))
+        return [("rewrite", album_path, list(found))] if found else []
+
+    def rewrite(found):
+        album_path = work.rewrite(found)
+        return [("upload", album_path, album_path)] if album_path and UPLOAD else []
+
+    def upload(album_path):
+        if work.upload(album_path) is None:
+            # None also means "nothing to upload"; only a failure recorded in the ledger is retried
+            entry = work.ledgers.for_album(album_path).entry(album_path)
+            if entry and entry["status"] == FAILED:
+                raise RuntimeError(entry["last_error"] or "upload failed")
+        return []
+
+    return {"crawl": crawl, "download": download, "enrich": enrich, "rewrite": rewrite, "upload": upload}
+
+
+def seed_queue(queue, categories=None):
+    """Queue a crawl of every category (again, if an earlier crawl finished). Returns how many were queued."""
+    return sum(queue.enqueue("crawl", url, url, requeue=True) for url in categories or scraper.TARGET_CATEGORIES)
+
+
+def run_workers(stages=None, queue_path=None, drain=False):
+    """Serve queue jobs of the given stages on this node until interrupted (or until the queue drains)."""
+    scraper.setup_logging()
+    stages = stages or [stage for stage in QUEUE_STAGES if UPLOAD or stage != "upload"]
+    queue = WorkQueue(queue_path)
+    work = PipelineWork(stages)
+    handlers = queue_handlers(work)
+    workers = dict(QUEUE_WORKERS, upload=STAGE_WORKERS["upload"] if work.api is not None else 1)
+    stop = threading.Event()
+    results = []
+
+    def serve(stage):
+        results.append((stage, run_worker(queue, {stage: handlers[stage]}, stop, exit_when_idle=drain)))
+
+    threads = [threading.Thread(target=serve, args=(stage,), name=f"queue-{stage}-{n}", daemon=True)
+               for stage in stages for n in range(workers[stage])]
+    print(f"[→] Serving {', '.join(stages)} jobs from {queue_path or work_queue.QUEUE_PATH}")
+    try:
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+    except KeyboardInterrupt:
+        print("[!] Stopping after the running jobs; unfinished leases expire and are picked up elsewhere.")
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        work.close()
+        totals = {}
+        for stage, stats in results:
+            for key, value in stats.items():
+                totals.setdefault(stage, {}).setdefault(key, 0)
+                totals[stage][key] += value
+        for stage, stats in totals.items():
+            print(f"[✓] {stage}: {stats['done']} done, {stats['failed']} failed, {stats['lost']} lost leases")
+        print(f"[✓] Queue: {queue.counts()}")
+        queue.close()
+
+
+def main():
+    scraper.setup_logging()
+    work = PipelineWork()
+    listed = []
+
+    def albums():
+        for category_url in scraper.TARGET_CATEGORIES:
+            category, tasks = work.list_albums(category_url)
+            if category:
+                listed.append(category_url)
+            yield from tasks
+
+    stages = [
+        Stage("download", work.download, STAGE_WORKERS["download"]),
+        Stage("preprocess", work.preprocess, STAGE_WORKERS["preprocess"]),
+        Stage("lens", work.lens, STAGE_WORKERS["lens"]),
+        Stage("rewrite", work.rewrite, STAGE_WORKERS["rewrite"]),
+    ]
+    if UPLOAD:
+        # The Selenium form runs in a single manually logged-in browser
+        stages.append(Stage("upload", work.upload, STAGE_WORKERS["upload"] if work.api is not None else 1))
+
+    try:
+        run_pipeline(albums(), stages)
+        for category_url in listed:
+            for album_url in work.index.sweep_deleted(category_url):
+                print(f"[-] Album no longer listed: {album_url}")
+    finally:
+        work.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import time
+import random
+import logging
+import threading
+from urllib.parse import urlparse
+
+from metrics import METRICS
+
+# ========== CONFIG ==========
+# Host suffix -> (requests per second, burst, min rate, max rate); longest matching suffix wins
+HOST_LIMITS = {
+    "yupoo.com": (4.0, 8, 0.5, 20.0),          # Yupoo pages and photo CDN
+    "google.com": (0.33, 1, 0.05, 1.0),        # Lens searches
+    "admin.shopify.com": (1.0, 2, 0.1, 1.0),   # Admin UI navigations; the uploader waits on page signals
+    "myshopify.com": (20.0, 20, 1.0, 50.0),    # Admin API; GraphQL cost is paced by shopify_api.CostBucket
+    "openai.com": (1.0, 4, 0.1, 10.0),
+}
+DEFAULT_LIMIT = (0.5, 2, 0.1, 5.0)             # Brand and retailer sites
+SLOW_LATENCY = 5.0         # Seconds; slower responses nudge the rate down
+INCREASE_STEP = 0.05       # Additive increase per healthy response, as a fraction of the host's configured rate
+DECREASE_FACTOR = 0.5      # Multiplicative decrease on 429/5xx
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# ============================
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter for the given (zero-based) retry attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def host_of(url_or_host):
+    if "://" in url_or_host:
+        return (urlparse(url_or_host).hostname or "").lower()
+    return url_or_host.lower()
+
+
+class TokenBucket:
+    """Token bucket whose refill rate can be tuned at runtime (AIMD)."""
+
+    def __init__(self, rate, capacity, min_rate, max_rate):
+        self.rate = rate
+        self.step = rate * INCREASE_STEP  # Fixed per bucket, so recovery after a decrease is linear
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available, then take them. Returns the seconds spent waiting."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = max(self.paused_until - now, (amount - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def increase(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def decrease(self, factor=DECREASE_FACTOR, pause=0.0):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0)
+            if pause:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+
+class RateLimiter:
+    """Per-host token buckets shared by every stage, adapted from observed responses."""
+
+    def __init__(self, limits=None, default=DEFAULT_LIMIT):
+        self.limits = dict(HOST_LIMITS if limits is None else limits)
+        self.default = default
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _key(self, host):
+        matches = [suffix for suffix in self.limits if host == suffix or host.endswith("." + suffix)]
+        return max(matches, key=len) if matches else host
+
+    def bucket(self, url_or_host):
+        key = self._key(host_of(url_or_host))
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(*self.limits.get(key, self.default))
+            return self.buckets[key]
+
+    def wait(self, url_or_host):
+        """Block until the host's bucket allows another request."""
+        return self.bucket(url_or_host).acquire()
+
+    def report(self, url_or_host, status=None, latency=None, retry_after=None):
+        """Feed a response (or status=None for a connection error) back into the host's rate."""
+        bucket = self.bucket(url_or_host)
+        if status is None or status in RETRY_STATUSES:
+            pause = float(retry_after) if retry_after and str(retry_after).isdigit() else 0.0
+            bucket.decrease(pause=pause)
+            METRICS.incr("throttled", host=self._key(host_of(url_or_host)))
+            logging.info(f"Throttling {host_of(url_or_host)} to {bucket.rate:.2f} req/s (status {status})")
+        elif latency is not None and latency > SLOW_LATENCY:
+            bucket.decrease(factor=0.9)
+        elif status < 400:
+            bucket.increase()
+
+    def call(self, url, func, attempts=MAX_RETRIES):
+        """Retry scheduler: run func() (returning a response) paced by the limiter, retrying with backoff.
+
+        Responses with a status in RETRY_STATUSES and raised exceptions are retried; the last
+        response is returned, or the last exception re-raised once attempts are used up.
+        """
+        for attempt in range(attempts):
+            self.wait(url)
+            started = time.monotonic()
+            try:
+                response = func()
+            except Exception:
+                self.report(url, None)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                self.report(url, response.status_code, time.monotonic() - started,
+                            response.headers.get("Retry-After"))
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+            METRICS.incr("retries", host=self._key(host_of(url)))
+            time.sleep(backoff_delay(attempt))
+
+
+# Shared by the scraper, the enrichment stage and the uploader
+LIMITER = RateLimiter()
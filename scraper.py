@@ -1,20 +1,20 @@
 import os
-import time
 import re
-import requests
 import hashlib
-from selenium import webdriver
+import downloader
+from crawl_index import CrawlIndex, conditional_headers
+from image_store import ImageStore
+from html_snapshot import parse_html
+from rate_limiter import LIMITER
+from metrics import METRICS
+from driver_pool import DriverPool, new_chrome, mark_broken
+from concurrent.futures import ThreadPoolExecutor
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-
-# Configure logging
+from selenium.common.exceptions import TimeoutException
+# selenium.webdriver.support (WebDriverWait, expected_conditions) takes ~0.3s to import,
+# so the browser-only functions below import it on first use and HTTP crawls never load it
 import logging
-logging.basicConfig(filename='scraper.log', level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
 
 # ========== CONFIG ==========
 BASE_URL = "https://luxurysotre999.x.yupoo.com" # Chinese Website URL
@@ -23,33 +23,47 @@ TARGET_CATEGORIES = [
    #  "/categories/3396640"   # Loro Piana Shoes
 ]
 BASE_DOWNLOAD_DIR = "downloads/LouisVuitton_Bags"
+CRAWL_MODE = "http"  # "http" parses server-rendered pages; "browser" always drives Chrome
+CATEGORY_WORKERS = 2    # Categories crawled in parallel
+ALBUM_WORKERS = 4       # Albums crawled in parallel within each category
+BROWSER_POOL_SIZE = 2   # Warm headless browsers shared by all workers
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
     "Referer": "https://luxurysotre999.x.yupoo.com/"
 }
 # ============================
 
+def setup_logging():
+    """Send the pipeline's log records to scraper.log (called by the entry points, not on import)."""
+    logging.basicConfig(filename='scraper.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
 def clean_name(name):
     """Sanitize names for filesystem compatibility."""
     return re.sub(r'[\\\\/*?:\"<>|]', "_", name)
 
-def setup_driver():
-    """Initialize Selenium WebDriver with Chrome options."""
+def chrome_options():
+    """Chrome options used by the scraper's browsers."""
     options = Options()
     options.add_argument("--start-maximized")
-    # options.add_argument("--headless")  # Uncomment to run in headless mode
     options.add_argument("--disable-notifications")
     options.add_argument("--disable-infobars")
     options.add_argument("--disable-extensions")
+    return options
+
+def setup_driver():
+    """Initialize a single (non-pooled) Selenium WebDriver with Chrome options."""
     logging.info("Starting ChromeDriver using webdriver-manager")
-    service = Service(ChromeDriverManager().install())
-    return webdriver.Chrome(service=service, options=options)
+    return new_chrome(chrome_options())
 
 def get_category(driver, category_url):
     """Get the target category based on the provided URL and extract its name."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     logging.info(f"Collecting category from {BASE_URL}{category_url}")
     try:
         full_url = f"{BASE_URL}{category_url}" if not category_url.startswith("http") else category_url
+        LIMITER.wait(full_url)
         driver.get(full_url)
         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, f"//a[@href='{category_url}']")))
         category_element = driver.find_element(By.XPATH, f"//a[@href='{category_url}']")
@@ -58,24 +72,32 @@ def get_category(driver, category_url):
     except Exception as e:
         logging.error(f"Failed to collect category {category_url}: {e}")
         print(f"[!] Failed to collect category {category_url}: {e}")
+        mark_broken(driver, e)
         return None
 
 def scroll_to_bottom(driver):
     """Scroll to the bottom of the page to load all content."""
+    from selenium.webdriver.support.ui import WebDriverWait
     try:
         last_height = driver.execute_script("return document.body.scrollHeight")
         while True:
+            # Each scroll triggers a lazy-load request, so pace it like any other Yupoo request
+            LIMITER.wait(driver.current_url)
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
+            try:
+                WebDriverWait(driver, 2, poll_frequency=0.2).until(
+                    lambda d: d.execute_script("return document.body.scrollHeight") != last_height)
+            except TimeoutException:
                 break
-            last_height = new_height
+            last_height = driver.execute_script("return document.body.scrollHeight")
     except Exception as e:
         logging.error(f"Failed to scroll: {e}")
+        mark_broken(driver, e)
 
 def get_album_links(driver):
     """Collect album links from a category page without pagination."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     logging.info("Collecting album links from current page")
     all_albums = []
     try:
@@ -96,10 +118,14 @@ def get_album_links(driver):
     except Exception as e:
         logging.error(f"Failed to collect album links: {e}")
         print(f"[!] Failed to collect album links: {e}")
+        mark_broken(driver, e)
         return []
 
+@METRICS.timed("get_image_links")
 def get_image_links(driver):
     """Extract image URLs from an album page using data-origin-src."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     logging.info("Collecting image links")
     try:
         scroll_to_bottom(driver)
@@ -130,86 +156,241 @@ def get_image_links(driver):
     except Exception as e:
         logging.error(f"Failed to collect image links: {e}")
         print(f"    [!] Failed to collect images: {e}")
+        mark_broken(driver, e)
         return []
 
-def download_images(image_links, category_name, album, cookies):
-    """Download up to the first 5 images to the specified directory with session cookies and retries."""
-    save_path = os.path.join(BASE_DOWNLOAD_DIR, clean_name(category_name), clean_name(album))
+def fetch_page(session, url, headers=None):
+    """GET a page over the pooled HTTP session. Returns the response (200 or 304), or None."""
+    try:
+        response = LIMITER.call(url, lambda: session.get(url, timeout=30, headers=headers))
+        if response.status_code in (200, 304):
+            return response
+        logging.warning(f"HTTP {response.status_code} for {url}")
+    except Exception as e:
+        logging.error(f"Failed to fetch {url}: {e}")
+    return None
+
+def fetch_html(session, url):
+    """Fetch a page over the pooled HTTP session and return its HTML, or None on failure."""
+    response = fetch_page(session, url)
+    return response.text if response is not None and response.status_code == 200 else None
+
+def http_get_category(session, category_url):
+    """Browserless variant of get_category that reads the category name from static HTML.
+
+    Returns None when the page has no named link to the category, so the caller falls back to the browser.
+    """
+    full_url = f"{BASE_URL}{category_url}" if not category_url.startswith("http") else category_url
+    html = fetch_html(session, full_url)
+    if html is None:
+        return None
+    links = parse_html(html).find_all("a", href=category_url)
+    category_name = next((a["text"].strip() for a in links if a["text"].strip()), None)
+    if category_name is None:
+        logging.info(f"No category link for {category_url} in the static HTML")
+        return None
+    return {"name": clean_name(category_name), "url": full_url}
+
+def http_get_album_links(session, category_page_url):
+    """Browserless variant of get_album_links. Returns [] when the selector finds nothing."""
+    html = fetch_html(session, category_page_url)
+    if html is None:
+        return []
+    all_albums = []
+    for a in parse_html(html).find_all("a", classes=("album__main",)):
+        href = a["attrs"].get("href")
+        title = a["attrs"].get("title") or "Untitled_Album"
+        if href:
+            if not href.startswith("http"):
+                href = BASE_URL.split("/categories")[0] + href
+            all_albums.append({"title": clean_name(title), "url": href})
+    logging.info(f"Found {len(all_albums)} albums over HTTP")
+    return all_albums
+
+@METRICS.timed("http_get_image_links")
+def http_get_image_links(session, album_url):
+    """Browserless variant of get_image_links. Returns [] when the selector finds nothing."""
+    html = fetch_html(session, album_url)
+    return parse_image_links(html) if html is not None else []
+
+def parse_image_links(html):
+    """Read data-origin-src image URLs from album page HTML."""
+    image_elements = parse_html(html).find_all(
+        "img", classes=("autocover", "image__img", "image__portrait"), data_type="photo", data_origin_src=True)
+    full_image_urls = []
+    for img in image_elements:
+        url = img["attrs"]["data-origin-src"]
+        if url:
+            if url.startswith("//"):
+                url = "https:" + url
+            full_image_urls.append(url)
+    logging.info(f"Found {len(full_image_urls)} image URLs over HTTP")
+    return full_image_urls
+
+def album_dir(category_name, album):
+    """Local folder holding an album's images."""
+    return os.path.join(BASE_DOWNLOAD_DIR, clean_name(category_name), clean_name(album))
+
+@METRICS.timed("download_images")
+def download_images(image_links, category_name, album, cookies, session=None, index=None, album_url=None,
+                    store=None):
+    """Download up to the first 5 images concurrently, streaming each one to disk.
+
+    With a CrawlIndex, known images are requested conditionally and every result is recorded.
+    With an ImageStore, downloaded files are deduplicated by content and near-duplicate albums flagged.
+    """
+    save_path = album_dir(category_name, album)
     os.makedirs(save_path, exist_ok=True)
-    s = requests.Session()
-    for cookie in cookies:
-        s.cookies.set(cookie['name'], cookie['value'])
-    s.headers.update(HEADERS)
+    if session is None:
+        session = downloader.build_session(HEADERS)
+    downloader.set_cookies(session, cookies)
 
     # Limit to the first 5 images
     image_links = image_links[:5]
     print(f"    ↳ Processing up to {len(image_links)} images (limited to first 5)")
 
+    jobs = []
     for idx, img_url in enumerate(image_links):
-        try:
-            ext = img_url.split(".")[-1].split("?")[0][:4]
-            hash_id = hashlib.md5(img_url.encode()).hexdigest()[:8]
-            filename = f"image_{idx+1}_{hash_id}.{ext}"
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = s.get(img_url, timeout=30)
-                    if response.status_code == 200:
-                        with open(os.path.join(save_path, filename), "wb") as f:
-                            f.write(response.content)
-                        print(f"Downloaded {filename} to {save_path}")
-                        logging.info(f"Downloaded {filename} to {save_path}")
-                        break
-                    else:
-                        print(f"[!] Attempt {attempt+1} failed with status {response.status_code}")
-                except Exception as e:
-                    print(f"[!] Attempt {attempt+1} failed: {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(5)
+        ext = img_url.split(".")[-1].split("?")[0][:4]
+        hash_id = hashlib.md5(img_url.encode()).hexdigest()[:8]
+        filename = f"image_{idx+1}_{hash_id}.{ext}"
+        headers = conditional_headers(index.image(img_url)) if index else None
+        jobs.append((img_url, os.path.join(save_path, filename), headers))
+
+    results = downloader.ImageDownloader(session).download_all(jobs)
+    for (img_url, dest, _), result in zip(jobs, results):
+        if result:
+            if index:
+                index.record_image(album_url, result)
+            if store and not result.get("not_modified"):
+                store.add(result["path"], result["sha256"])
+            if result.get("not_modified"):
+                print(f"Unchanged {os.path.basename(dest)}")
             else:
-                print(f"[!] Failed to download {img_url} after {max_retries} attempts")
-                logging.error(f"Failed to download {img_url} after {max_retries} attempts")
-        except Exception as e:
-            print(f"[!] Failed to download {img_url} - {e}")
-            logging.error(f"Failed to download {img_url}: {e}")
-        time.sleep(1)
+                print(f"Downloaded {os.path.basename(dest)} to {save_path}")
+        else:
+            print(f"[!] Failed to download {img_url} after retries")
+    if store:
+        duplicate_of = store.flag_duplicate_album(save_path)
+        if duplicate_of:
+            print(f"    [=] Album looks like a duplicate of {duplicate_of}")
+    return [r for r in results if r]
 
-def main():
-    driver = setup_driver()
-    try:
-        for cat_idx, category_url in enumerate(TARGET_CATEGORIES, 1):
-            print(f"\n[→] Processing category {cat_idx}/{len(TARGET_CATEGORIES)}: {category_url}")
+@METRICS.timed("crawl_album", album="album")
+def process_album(album, category, category_url, session, index, store, pool):
+    """Crawl one album over HTTP (browser fallback from the pool) and download its new images.
+
+    Returns (album folder, status) where status is 'new', 'changed' or 'unchanged'.
+    """
+    image_links, etag, last_modified = [], None, None
+    if CRAWL_MODE == "http":
+        response = fetch_page(session, album['url'], conditional_headers(index.album(album['url'])))
+        if response is not None and response.status_code == 304:
+            if index.album_files_present(album['url']):
+                index.touch_album(album['url'])
+                print(f"    ↳ Album not modified, skipping: {album['url']}")
+                return album_dir(category['name'], album['title']), "unchanged"
+            # Page unchanged but local files are missing: get the full page to re-download them
+            response = fetch_page(session, album['url'])
+        if response is not None and response.status_code == 200:
+            image_links = parse_image_links(response.text)
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    cookies = []
+    if not image_links:
+        with pool.driver() as driver:
+            LIMITER.wait(album['url'])
+            driver.get(album['url'])
+            image_links = get_image_links(driver)
+            cookies = driver.get_cookies()
+    status = index.record_album(category_url, category['name'], album['url'], album['title'],
+                                image_links[:5], etag, last_modified)
+    if status == "unchanged":
+        print(f"    ↳ Album images unchanged, skipping: {album['url']}")
+        return album_dir(category['name'], album['title']), status
+    print(f"    ↳ Downloading up to 5 images ({status} album): {album['url']}")
+    results = download_images(image_links, category['name'], album['title'], cookies, session,
+                              index, album['url'], store)
+    if len(results) == len(image_links[:5]) and (etag or last_modified):
+        index.set_validators(album['url'], etag, last_modified)
+    return album_dir(category['name'], album['title']), status
+
+@METRICS.timed("list_albums")
+def list_albums(category_url, session, pool):
+    """Resolve a category and list its albums. Returns (category, albums) or (None, [])."""
+    category = http_get_category(session, category_url) if CRAWL_MODE == "http" else None
+    if not category:
+        with pool.driver() as driver:
             category = get_category(driver, category_url)
-            if not category:
-                print(f"[!] No valid category found for {category_url}. Skipping.")
-                continue
+    if not category:
+        print(f"[!] No valid category found for {category_url}. Skipping.")
+        return None, []
 
-            print(f"[✓] Found category: {category['name']}.\n")
-            print(f"[→] Opening category: {category['name']}")
+    print(f"[✓] Found category: {category['name']}.\n")
+    print(f"[→] Opening category: {category['name']}")
+    albums = http_get_album_links(session, category['url']) if CRAWL_MODE == "http" else []
+    if not albums:
+        with pool.driver() as driver:
+            LIMITER.wait(category['url'])
             driver.get(category['url'])
-            time.sleep(3)
             print("[*] Scrolling and grabbing all product albums...")
             albums = get_album_links(driver)
-            print(f"[✓] Found {len(albums)} albums.\n")
-
-            for idx, album in enumerate(albums, 1):
-                print(f"[{idx}/{len(albums)}] Visiting album: {album['url']}")
-                try:
-                    driver.get(album['url'])
-                    time.sleep(2)
-                    image_links = get_image_links(driver)
-                    cookies = driver.get_cookies()
-                    print(f"    ↳ Downloading up to 5 images...")
-                    download_images(image_links, category['name'], album['title'], cookies)
-                except Exception as e:
-                    print(f"    [!] Failed album: {album['url']} - {e}")
-                    logging.error(f"Failed album {album['url']}: {e}")
+    print(f"[✓] Found {len(albums)} albums.\n")
+    return category, albums
+
+def process_category(cat_idx, category_url, session, index, store, pool):
+    """Collect a category's albums and crawl them with ALBUM_WORKERS threads."""
+    print(f"\n[→] Processing category {cat_idx}/{len(TARGET_CATEGORIES)}: {category_url}")
+    category, albums = list_albums(category_url, session, pool)
+    if not category:
+        return
+
+    def run(idx_album):
+        idx, album = idx_album
+        print(f"[{idx}/{len(albums)}] Visiting album: {album['url']}")
+        try:
+            process_album(album, category, category_url, session, index, store, pool)
+        except Exception as e:
+            print(f"    [!] Failed album: {album['url']} - {e}")
+            logging.error(f"Failed album {album['url']}: {e}")
+
+    with ThreadPoolExecutor(max_workers=ALBUM_WORKERS) as workers:
+        list(workers.map(run, enumerate(albums, 1)))
+
+    if albums:
+        deleted = index.sweep_deleted(category_url)
+        for album_url in deleted:
+            print(f"[-] Album no longer listed: {album_url}")
+
+def main():
+    setup_logging()
+    session = downloader.build_session(HEADERS, pool_size=downloader.MAX_WORKERS * ALBUM_WORKERS)
+    index = CrawlIndex()
+    store = ImageStore()
+    # Browsers start lazily on first lease, so an HTTP-only crawl never launches Chrome
+    pool = DriverPool(chrome_options, size=BROWSER_POOL_SIZE)
+    if CRAWL_MODE == "browser":
+        pool.warm_up()
 
+    def run(idx_category):
+        cat_idx, category_url = idx_category
+        try:
+            process_category(cat_idx, category_url, session, index, store, pool)
+        except Exception as e:
+            print(f"[!] Failed category {category_url}: {e}")
+            logging.error(f"Failed category {category_url}: {e}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=CATEGORY_WORKERS) as workers:
+            list(workers.map(run, enumerate(TARGET_CATEGORIES, 1)))
     except Exception as e:
         print(f"[!] Scraper failed: {e}")
         logging.error(f"Scraper failed: {e}")
     finally:
-        driver.quit()
+        pool.close()
+        index.close()
+        store.close()
+        for kind, counts in index.report.items():
+            print(f"[✓] {kind.capitalize()}: " + ", ".join(f"{n} {state}" for state, n in counts.items()))
         print("\n[✓] Done downloading all categories and albums.")
 
 if __name__ == "__main__":
@@ -1,143 +1,280 @@
 import os
-import time
+import re
 import json
+import hashlib
+import logging
+from urllib.parse import quote
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+from driver_pool import new_chrome
+from rate_limiter import LIMITER
+from shopify_api import album_image_paths
+from catalog import Catalog, CATALOG_FILE
+from metrics import METRICS
+from admin_waits import (install_network_tracker, ensure_network_tracker, wait_network_idle,
+                         wait_media_processed, media_count, wait_saved, product_link_id, SaveFailed)
+from image_store import ImageStore
+from media_registry import EXCLUDE_FILLER
+from upload_ledger import UploadLedger, LEDGER_FILE, albums_to_upload
 
-# Setup options for the browser
-options = Options()
-options.add_argument("--start-maximized")
-options.add_argument("--disable-blink-features=AutomationControlled")
-options.add_experimental_option("excludeSwitches", ["enable-automation"])
-options.add_experimental_option("useAutomationExtension", False)
+ROOT_FOLDER = r"downloads\LouisVuitton_Bags"  # Define your brand folder here
+# Your Shopify admin url so you can manually login
+NEW_PRODUCT_URL = "https://admin.shopify.com/store/4ydup3-zv/products/new"
+SKU_INPUT_NAME = "sku"  # Name of the variant SKU field on the new product form
 
-# Initialize the WebDriver
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-wait = WebDriverWait(driver, 20)
+# Ledger error for a save that timed out; the product may exist, so a retry looks for it first
+SAVE_UNCONFIRMED = "save not confirmed"
 
 
-# Function to load the last processed album index to resume where it stopped
-def load_last_processed(category_folder):
-    try:
-        with open(f"{category_folder}_last_processed.json", "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {"album_index": 0}
-
-# Function to save the last processed album index
-def save_last_processed(category_folder, album_index):
-    with open(f"{category_folder}_last_processed.json", "w") as file:
-        json.dump({"album_index": album_index}, file)
-
-# Function to parse product details from a text file
-def parse_product_details(details_file_path):
-    with open(details_file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    name, description, price, brand = "", "", "", ""
-    for line in lines:
-        if line.startswith("Product Name:"):
-            name = line.split(":", 1)[1].strip()
-        elif line.startswith("Description:"):
-            description = line.split(":", 1)[1].strip()
-        elif line.startswith("Price:"):
-            price = line.split("$", 1)[1].strip()
-        elif line.startswith("Brand:"):
-            brand = line.split(":", 1)[1].strip()
-
-    return name, description, price, brand
+class SaveNotConfirmed(Exception):
+    pass
 
 
-ROOT_FOLDER = r"downloads\LouisVuitton_Bags"  # Define your brand folder here
+# Function to start the browser used for the admin UI
+def setup_driver():
+    # Setup options for the browser
+    options = Options()
+    options.add_argument("--start-maximized")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option("useAutomationExtension", False)
+
+    # Single visible browser, since the admin login is manual
+    driver = new_chrome(options)
+    install_network_tracker(driver)  # Lets the upload waits see when the admin UI has gone quiet
+    return driver
+
 
-category_folder = ROOT_FOLDER.split("\\")[-1]  # Extract category name from ROOT_FOLDER path
-last_processed_albums = load_last_processed(category_folder)
+# Function to adopt the old "<category>_last_processed.json" index into the upload ledger, once.
+# The index counted os.listdir() entries, so this trusts the listing order to match the last run.
+def migrate_last_processed(ledger, catalog, root_folder, category_folder):
+    index_file = f"{category_folder}_last_processed.json"
+    if not os.path.isfile(index_file) or ledger.counts():
+        return 0
+    with open(index_file, "r") as file:
+        album_index = json.load(file)["album_index"]
+    album_folders = [f for f in os.listdir(root_folder) if not f.startswith((CATALOG_FILE, LEDGER_FILE))]
+    adopted = 0
+    for album_folder in album_folders[:album_index]:
+        album_path = os.path.join(root_folder, album_folder)
+        product = catalog.product(album_path)
+        if product is not None and os.path.isdir(album_path):
+            ledger.record_uploaded(album_path, ledger.content_hash(album_path, product))
+            adopted += 1
+    os.replace(index_file, index_file + ".migrated")
+    return adopted
 
-for album_index, album_folder in enumerate(os.listdir(ROOT_FOLDER)):
-    if album_index < last_processed_albums["album_index"]:
-        continue  # Skip already processed albums
+# Function to read the numeric product ID from an admin URL like .../products/1234567890
+def product_id_from_url(url):
+    match = re.search(r"/products/(\d+)", url or "")
+    return match.group(1) if match else None
+
+# Function to check whether a changed album already has a product; the admin form can only create new ones,
+# so those albums are left to the API uploader's in-place update instead of being duplicated
+def changed_with_product(ledger, album_path, content_hash):
+    existing_id, current = ledger.existing_product(album_path, content_hash)
+    if existing_id and not current:
+        print(f"⏭️ {os.path.basename(album_path)} changed but product {existing_id} already exists; "
+              f"run the API uploader (--mode api) to update it")
+        return True
+    return False
+
+# Function to derive the SKU written for an album; it identifies the album's product on the products list
+def album_sku(album_path):
+    return "ALB-" + hashlib.md5(os.path.normpath(album_path).replace("\\", "/").encode()).hexdigest()[:12].upper()
+
+# Function to find the product saved for an album by its SKU (and exact title), returns its ID or None.
+# The title alone could match another album's product with the same brand and name.
+def find_album_product(driver, sku, title):
+    url = NEW_PRODUCT_URL.rsplit("/new", 1)[0] + "?query=" + quote(f"sku:{sku}")
+    try:
+        LIMITER.wait(url)
+        driver.get(url)
+        WebDriverWait(driver, 20).until(lambda x: x.execute_script("return document.readyState") == "complete")
+        ensure_network_tracker(driver)
+        wait_network_idle(driver)
+        return product_link_id(driver, title)
+    except Exception as e:
+        logging.warning(f"Could not search the products list for {sku}: {e}")
+        return None
 
-    album_path = os.path.join(ROOT_FOLDER, album_folder)
-    if not os.path.isdir(album_path):
-        continue
+# Function to create one product from an album's catalog record
+# Returns the product ID (or True if only a toast confirmed the save), False if it failed before saving,
+# raises SaveFailed if the admin reported an error and SaveNotConfirmed if the save was never confirmed
+def upload_album(driver, album_path, catalog, product=None, store=None):
+    wait = WebDriverWait(driver, 20)
+    album_folder = os.path.basename(album_path)
 
-    details_file = os.path.join(album_path, "product_details.txt")
-    if not os.path.exists(details_file):
-        print(f"❌ No product_details.txt in {album_path}, skipping.")
-        continue
+    product = product or catalog.product(album_path)
+    if product is None:
+        print(f"❌ No catalog record for {album_path}, skipping.")
+        return False
 
-    title, desc, price, brand = parse_product_details(details_file)
+    title, desc, brand = product["name"], product["description"], product["brand"]
+    price = f"{product['price']:g}" if product["price"] is not None else ""
     final_title = f"{brand} {title}"
 
     print(f"\n➡️ Starting upload for album: {album_folder} ({final_title})")  # Print album name and title
-    # Your Shopify admin url so you can manually login
-    driver.get("https://admin.shopify.com/store/4ydup3-zv/products/new")
-    time.sleep(3)
+    with METRICS.span("upload_open_form", album=album_folder):
+        LIMITER.wait(NEW_PRODUCT_URL)
+        driver.get(NEW_PRODUCT_URL)
+        wait.until(lambda x: x.execute_script("return document.readyState") == "complete")
+        ensure_network_tracker(driver)
+        wait_network_idle(driver)
 
     # Title
-    title_input = wait.until(EC.presence_of_element_located((By.NAME, "title")))
-    title_input.clear()
-    title_input.send_keys(final_title)
-    print("✅ Title set.")
+    with METRICS.span("upload_title", album=album_folder):
+        title_input = wait.until(EC.presence_of_element_located((By.NAME, "title")))
+        title_input.clear()
+        title_input.send_keys(final_title)
+        print("✅ Title set.")
 
     # Description
-    iframe = wait.until(EC.presence_of_element_located((By.ID, "product-description_ifr")))
-    driver.switch_to.frame(iframe)
-    body = wait.until(EC.presence_of_element_located((By.ID, "tinymce")))
-    body.clear()
-    body.send_keys(desc)
-    driver.switch_to.default_content()
-    print("✅ Description set.")
+    with METRICS.span("upload_description", album=album_folder):
+        iframe = wait.until(EC.presence_of_element_located((By.ID, "product-description_ifr")))
+        driver.switch_to.frame(iframe)
+        body = wait.until(EC.presence_of_element_located((By.ID, "tinymce")))
+        body.clear()
+        body.send_keys(desc)
+        driver.switch_to.default_content()
+        print("✅ Description set.")
 
     # Price
-    price_input = wait.until(EC.presence_of_element_located((By.NAME, "price")))
-    price_input.clear()
-    price_input.send_keys(price)
-    print("✅ Price set.")
+    with METRICS.span("upload_price", album=album_folder):
+        price_input = wait.until(EC.presence_of_element_located((By.NAME, "price")))
+        price_input.clear()
+        price_input.send_keys(price)
+        print("✅ Price set.")
 
     # --- Product type ---
-    type_input = wait.until(EC.presence_of_element_located((By.NAME, "productType")))
-    type_input.clear()
-    prod_type = "Bags"  # Hardcoded as per your request
-    type_input.send_keys(prod_type)  # Just inputting the product type without hitting enter
-    print(f"🗂️ Product type set: {prod_type}")
+    with METRICS.span("upload_product_type", album=album_folder):
+        type_input = wait.until(EC.presence_of_element_located((By.NAME, "productType")))
+        type_input.clear()
+        prod_type = "Bags"  # Hardcoded as per your request
+        type_input.send_keys(prod_type)  # Just inputting the product type without hitting enter
+        print(f"🗂️ Product type set: {prod_type}")
 
     # --- Quantity ---
-    qty_input = wait.until(EC.presence_of_element_located((By.NAME, "inventoryLevels[0]")))
-    qty_input.clear()
-    qty_input.send_keys("10")  # Set quantity to 10
-    print("📦 Quantity set: 10")
-
-    # --- Images ---
-    image_paths = [
-        os.path.abspath(os.path.join(album_path, img_file))
-        for img_file in os.listdir(album_path)
-        if img_file.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
-    upload_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']")))
-
-    # Upload all images first
-    for idx, img_path in enumerate(image_paths, start=1):
-        upload_input.send_keys(img_path)
-        print(f"🖼️ Uploaded image {idx}: {os.path.basename(img_path)}")
-        time.sleep(4)  # Reduce the time delay to make the process faster
+    with METRICS.span("upload_quantity", album=album_folder):
+        qty_input = wait.until(EC.presence_of_element_located((By.NAME, "inventoryLevels[0]")))
+        qty_input.clear()
+        qty_input.send_keys("10")  # Set quantity to 10
+        print("📦 Quantity set: 10")
+
+    # --- SKU --- (album-specific, so an unconfirmed save can be found again without relying on the title)
+    sku = album_sku(album_path)
+    with METRICS.span("upload_sku", album=album_folder):
+        sku_input = wait.until(EC.presence_of_element_located((By.NAME, SKU_INPUT_NAME)))
+        sku_input.clear()
+        sku_input.send_keys(sku)
+        print(f"🏷️ SKU set: {sku}")
+
+    # --- Images --- (normalized, EXIF-stripped derivatives, without shared filler shots if configured)
+    with METRICS.span("upload_prepare_images", album=album_folder):
+        image_paths = album_image_paths(album_path, product, store)
+        upload_input = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='file']")))
+
+    # Upload all images in one go, then wait until Shopify has processed them
+    with METRICS.span("upload_images", album=album_folder):
+        if image_paths:
+            before = media_count(driver)
+            if upload_input.get_attribute("multiple"):
+                upload_input.send_keys("\n".join(image_paths))
+            else:
+                for img_path in image_paths:
+                    upload_input.send_keys(img_path)
+            print(f"🖼️ Sent {len(image_paths)} images")
+            if not wait_media_processed(driver, len(image_paths), baseline=before):
+                print("⚠️ Media still processing after the timeout, saving anyway.")
 
     print("✅ All images uploaded.")
 
     # --- Save ---
-    save_button = WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.XPATH, "//button[@type='submit' and text()='Save']")))
-    save_button.click()
-    print(f"💾 Saved product: {final_title}")
+    with METRICS.span("upload_save", album=album_folder):
+        save_button = WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.XPATH, "//button[@type='submit' and text()='Save']")))
+        save_button.click()
+        try:
+            saved = wait_saved(driver)
+        except SaveFailed as e:
+            print(f"❌ Shopify rejected the save for {final_title}: {e}")
+            raise
+        if not saved:
+            # The save may still have gone through; look for the product before anyone retries it
+            print(f"⚠️ Save was not confirmed for {final_title}, checking the products list")
+            saved = find_album_product(driver, sku, final_title)
+        if not saved:
+            print(f"❌ Save was not confirmed for {final_title}")
+            raise SaveNotConfirmed(final_title)
+        print(f"💾 Saved product: {final_title}")
+    catalog.mark_uploaded(album_path)
+    return saved
+
+# Function to upload one album and record the outcome in the ledger, returns the product ID (or True) or None
+def upload_with_ledger(driver, ledger, catalog, album_path, product, content_hash, store=None):
+    if changed_with_product(ledger, album_path, content_hash):
+        return None
+    entry = ledger.entry(album_path)
+    if entry and entry["last_error"] == SAVE_UNCONFIRMED:
+        # The last save timed out but may have completed since
+        product_id = find_album_product(driver, album_sku(album_path), f"{product['brand']} {product['name']}")
+        if product_id:
+            print(f"🔎 Found product {product_id} from the earlier unconfirmed save")
+            ledger.start(album_path, content_hash)
+            ledger.finish(album_path, product_id=product_id)
+            catalog.mark_uploaded(album_path)
+            return product_id
+    ledger.start(album_path, content_hash)
+    try:
+        saved = upload_album(driver, album_path, catalog, product, store)
+    except SaveNotConfirmed:
+        ledger.finish(album_path, error=SAVE_UNCONFIRMED)
+        return None
+    except Exception as e:
+        ledger.finish(album_path, error=str(e)[:500])
+        print(f"[!] Upload failed for {os.path.basename(album_path)}: {e}")
+        return None
+    if not saved:
+        ledger.finish(album_path, error="upload did not complete")
+        return None
+    product_id = saved if saved is not True else product_id_from_url(driver.current_url)
+    ledger.finish(album_path, product_id=product_id)
+    return product_id or True
+
+
+def main(root_folder=None):
+    root_folder = root_folder or ROOT_FOLDER
+    driver = setup_driver()
+    category_folder = root_folder.split("\\")[-1]  # Extract category name from ROOT_FOLDER path
+    catalog = Catalog(root_folder)
+    ledger = UploadLedger(root_folder)
+    store = ImageStore() if EXCLUDE_FILLER else None
+    try:
+        imported = catalog.import_legacy()
+        if imported:
+            print(f"📥 Imported {imported} product_details.txt files into the catalog")
+        adopted = migrate_last_processed(ledger, catalog, root_folder, category_folder)
+        if adopted:
+            print(f"📥 Marked {adopted} albums from the old resume index as uploaded")
 
-    save_last_processed(category_folder, album_index + 1)  # Save progress after each album
-    time.sleep(7)
+        # Only new, changed, failed or interrupted albums, whatever the directory order
+        todo = albums_to_upload(ledger, catalog, root_folder)
+        print(f"📋 {len(todo)} albums to upload")
+        for album_path, product, content_hash, reason in todo:
+            print(f"\n➡️ {os.path.basename(album_path)} ({reason})")
+            upload_with_ledger(driver, ledger, catalog, album_path, product, content_hash, store)
 
-print("\n🎉 All products uploaded successfully!")
+        print(f"\n🎉 Upload run finished: {ledger.counts()}")
+    finally:
+        # Close the browser even when the run is interrupted, so no Chrome processes are left behind
+        driver.quit()
+        ledger.close()
+        catalog.close()
+        if store is not None:
+            store.close()
 
 
+if __name__ == "__main__":
+    main()
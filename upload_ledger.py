@@ -0,0 +1,191 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+
+from db import locked
+from image_store import file_sha256
+from catalog import REWRITTEN, UPLOADED as CATALOG_UPLOADED
+
+LEDGER_FILE = "upload_ledger.sqlite"   # One per category folder, next to the catalog
+MAX_ATTEMPTS = 3                       # Failed albums are retried on later runs up to this many times
+
+PENDING, UPLOADED, FAILED = "pending", "uploaded", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    album TEXT PRIMARY KEY,
+    content_hash TEXT,
+    status TEXT,
+    product_id TEXT,
+    product_hash TEXT,
+    attempts INTEGER,
+    last_error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS uploads_by_status ON uploads (status);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT
+);
+"""
+
+
+class UploadLedger:
+    """Per-album upload state keyed by a hash of the album's images and product details."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.conn = sqlite3.connect(os.path.join(folder, LEDGER_FILE), check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        # Ledgers written before products were recorded as soon as they were created
+        columns = {r["name"] for r in self.conn.execute("PRAGMA table_info(uploads)")}
+        if "product_hash" not in columns:
+            self.conn.execute("ALTER TABLE uploads ADD COLUMN product_hash TEXT")
+            self.conn.commit()
+
+    @locked
+    def _file_hash(self, path):
+        # Re-hash a file only when its size or mtime changed, so a re-sync reads just the changes
+        st = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+            return row["sha256"]
+        sha256 = file_sha256(path)
+        self.conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                          (path, st.st_size, st.st_mtime_ns, sha256))
+        self.conn.commit()
+        return sha256
+
+    def content_hash(self, album_path, product):
+        """Hash of what would be uploaded: image contents plus brand, name, description and price."""
+        images = product["images"] or sorted(f for f in os.listdir(album_path)
+                                             if f.lower().endswith((".jpg", ".jpeg", ".png")))
+        image_hashes = sorted(self._file_hash(os.path.join(album_path, f)) for f in images
+                              if os.path.isfile(os.path.join(album_path, f)))
+        details = [product["brand"], product["name"], product["description"], product["price"]]
+        return hashlib.sha256(json.dumps([details, image_hashes]).encode("utf-8")).hexdigest()
+
+    @locked
+    def entry(self, album_path):
+        row = self.conn.execute("SELECT * FROM uploads WHERE album = ?", (os.path.basename(album_path),)).fetchone()
+        return dict(row) if row else None
+
+    def needs_upload(self, album_path, content_hash):
+        """(True, reason) for new, changed or retryable albums; (False, reason) otherwise."""
+        entry = self.entry(album_path)
+        if entry is None:
+            return True, "new"
+        if entry["content_hash"] != content_hash:
+            return True, "changed"
+        if entry["status"] == UPLOADED:
+            return False, "uploaded"
+        if entry["attempts"] >= MAX_ATTEMPTS:
+            return False, f"gave up after {entry['attempts']} attempts"
+        # An album left pending was interrupted halfway; retry it like a failure
+        return True, entry["status"]
+
+    def existing_product(self, album_path, content_hash):
+        """(product_id, current) for the album's Shopify product, if one was created.
+
+        current is True when the product was created from this content, so an interrupted
+        upload only has its remaining steps left to run.
+        """
+        entry = self.entry(album_path)
+        if entry is None or not entry["product_id"]:
+            return None, False
+        return entry["product_id"], entry["product_hash"] == content_hash
+
+    @locked
+    def start(self, album_path, content_hash):
+        """Mark an attempt as pending. A changed album starts counting attempts again."""
+        album = os.path.basename(album_path)
+        entry = self.entry(album_path)
+        attempts = entry["attempts"] + 1 if entry and entry["content_hash"] == content_hash else 1
+        self.conn.execute("INSERT OR REPLACE INTO uploads (album, content_hash, status, product_id, product_hash, "
+                          "attempts, last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                          (album, content_hash, PENDING, entry["product_id"] if entry else None,
+                           entry["product_hash"] if entry else None, attempts, time.time()))
+        self.conn.commit()
+
+    @locked
+    def created(self, album_path, product_id):
+        """Record that the album's product now carries the pending attempt's details and media.
+
+        Called right after productCreate (or a productUpdate of a changed album), before price and stock are set.
+        """
+        self.conn.execute("UPDATE uploads SET product_id = ?, product_hash = content_hash, updated_at = ? "
+                          "WHERE album = ?", (product_id, time.time(), os.path.basename(album_path)))
+        self.conn.commit()
+
+    @locked
+    def finish(self, album_path, product_id=None, error=None):
+        """Record the outcome of the pending attempt: uploaded (with the product ID) or failed."""
+        status = FAILED if error else UPLOADED
+        self.conn.execute("UPDATE uploads SET status = ?, product_id = COALESCE(?, product_id), "
+                          "product_hash = CASE WHEN ? = ? THEN content_hash ELSE product_hash END, "
+                          "last_error = ?, updated_at = ? WHERE album = ?",
+                          (status, product_id, status, UPLOADED, error, time.time(), os.path.basename(album_path)))
+        self.conn.commit()
+
+    @locked
+    def record_uploaded(self, album_path, content_hash, product_id=None):
+        """Adopt an album uploaded before the ledger existed."""
+        self.conn.execute("INSERT OR REPLACE INTO uploads (album, content_hash, status, product_id, product_hash, "
+                          "attempts, last_error, updated_at) VALUES (?, ?, ?, ?, ?, 0, NULL, ?)",
+                          (os.path.basename(album_path), content_hash, UPLOADED, product_id, content_hash,
+                           time.time()))
+        self.conn.commit()
+
+    @locked
+    def counts(self):
+        return {r["status"]: r["n"] for r in self.conn.execute("SELECT status, COUNT(*) AS n FROM uploads GROUP BY status")}
+
+    @locked
+    def close(self):
+        self.conn.close()
+
+
+def albums_to_upload(ledger, catalog, root_folder):
+    """[(album_path, product, content_hash, reason)] for every catalogued album that needs an upload."""
+    todo = []
+    for product in catalog.products():
+        album_path = os.path.join(root_folder, product["album"])
+        if product["status"] not in (REWRITTEN, CATALOG_UPLOADED) or not os.path.isdir(album_path):
+            continue
+        content_hash = ledger.content_hash(album_path, product)
+        if product["status"] == CATALOG_UPLOADED and ledger.entry(album_path) is None:
+            ledger.record_uploaded(album_path, content_hash)
+        upload, reason = ledger.needs_upload(album_path, content_hash)
+        if upload:
+            todo.append((album_path, product, content_hash, reason))
+        elif reason != "uploaded":
+            print(f"⏭️ Skipping {product['album']}: {reason}")
+    return todo
+
+
+class LedgerSet:
+    """Opens each category's ledger once and hands it out by album path."""
+
+    def __init__(self):
+        self.ledgers = {}
+        self.lock = threading.Lock()
+
+    def for_album(self, album_path):
+        folder = os.path.dirname(os.path.abspath(album_path))
+        with self.lock:
+            if folder not in self.ledgers:
+                self.ledgers[folder] = UploadLedger(folder)
+            return self.ledgers[folder]
+
+    def close(self):
+        with self.lock:
+            for ledger in self.ledgers.values():
+                ledger.close()
+            self.ledgers.clear()
@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+from db import locked
+from rate_limiter import backoff_delay
+from metrics import METRICS
+
+# ========== CONFIG ==========
+QUEUE_PATH = "downloads/work_queue.sqlite"   # Shared by every worker process; must be on a local disk
+LEASE_SECONDS = 300        # A job not heartbeated for this long is handed to another worker
+HEARTBEAT_SECONDS = 60     # How often a running job renews its lease
+MAX_ATTEMPTS = 3           # Attempts (failures or expired leases) before a job goes to the dead-letter list
+RETRY_BASE = 30            # Seconds; failed jobs wait a jittered, doubling delay before they are retried
+RETRY_CAP = 1800
+IDLE_POLL = 5              # Seconds an idle worker waits before asking for work again
+BUSY_TIMEOUT = 30          # Seconds a worker waits on another worker's write lock
+# ============================
+
+READY, LEASED, DONE, DEAD = "ready", "leased", "done", "dead"
+
+# Mount types whose file locking SQLite cannot rely on
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "fuse.sshfs", "fuse.glusterfs"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    stage TEXT,
+    key TEXT,
+    payload TEXT,
+    status TEXT,
+    attempts INTEGER,
+    max_attempts INTEGER,
+    lease_owner TEXT,
+    lease_expires REAL,
+    not_before REAL,
+    last_error TEXT,
+    rerun INTEGER DEFAULT 0,
+    created_at REAL,
+    updated_at REAL,
+    UNIQUE (stage, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, stage, not_before);
+CREATE INDEX IF NOT EXISTS jobs_leases ON jobs (status, lease_expires);
+"""
+
+
+def on_network_share(path):
+    """True if path is on an NFS/SMB share or a mapped network drive."""
+    path = os.path.abspath(path)
+    if os.name == "nt":
+        if path.startswith("\\\\"):
+            return True
+        import ctypes
+        drive_remote = 4
+        return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + "\\") == drive_remote
+    try:
+        with open("/proc/mounts", "r") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False  # No mount table to check (macOS)
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    for mount_point, fs in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > len(best):
+            best, fstype = mount_point, fs
+    return fstype in NETWORK_FILESYSTEMS
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+class LeaseLost(Exception):
+    """The worker no longer holds the job's lease (it expired and was handed to someone else)."""
+
+
+class WorkQueue:
+    """Album-level jobs per stage with time-limited leases, retries and a dead-letter list.
+
+    A job is leased to one worker at a time. The worker renews the lease while it runs and
+    completes or fails it at the end. A lease that expires (the worker crashed or lost
+    the network) makes the job available again, counting as an attempt. Jobs that run out
+    of attempts are parked as dead until they are requeued by hand.
+
+    The workers are processes on one machine. SQLite's locks are not reliable on NFS or SMB,
+    where two workers could lease the same job, so a queue file on a network share is refused.
+    """
+
+    def __init__(self, db_path=None):
+        db_path = db_path or QUEUE_PATH
+        if on_network_share(db_path):
+            raise ValueError(f"{db_path} is on a network share; the work queue needs a local disk")
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Autocommit mode, so leases can take the write lock up front with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        # Queues created before leased jobs could be asked to run again
+        columns = {r["name"] for r in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "rerun" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN rerun INTEGER DEFAULT 0")
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"]) if job["payload"] else None
+        return job
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def _enqueue(self, stage, key, payload, max_attempts, requeue, now):
+        # An existing job is only touched when asked to requeue it
+        row = self.conn.execute("SELECT id, status FROM jobs WHERE stage = ? AND key = ?", (stage, str(key))).fetchone()
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO jobs (stage, key, payload, status, attempts, max_attempts, not_before, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, 0, ?, ?)",
+                (stage, str(key), json.dumps(payload), READY, max_attempts, now, now))
+            return True
+        if not requeue:
+            return False
+        if row["status"] == READY:
+            # Still waiting: it runs once, with the newest payload, keeping its attempts and backoff
+            self.conn.execute("UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                              (json.dumps(payload), now, row["id"]))
+        elif row["status"] == LEASED:
+            # The running worker has the old payload; run it again with the new one once that attempt ends
+            self.conn.execute("UPDATE jobs SET payload = ?, max_attempts = ?, rerun = 1, updated_at = ? WHERE id = ?",
+                              (json.dumps(payload), max_attempts, now, row["id"]))
+        else:
+            self.conn.execute("UPDATE jobs SET payload = ?, status = ?, attempts = 0, max_attempts = ?, "
+                              "lease_owner = NULL, lease_expires = NULL, not_before = 0, last_error = NULL, "
+                              "rerun = 0, updated_at = ? WHERE id = ?",
+                              (json.dumps(payload), READY, max_attempts, now, row["id"]))
+        return True
+
+    @locked
+    def enqueue(self, stage, key, payload=None, max_attempts=MAX_ATTEMPTS, requeue=False):
+        """Add a job unless one with the same stage and key exists. Returns True if a job was queued.
+
+        With requeue, an existing job runs again with this payload: a finished or dead one is reset,
+        a ready one gets the new payload and a leased one is marked to run again after its attempt.
+        """
+        with self._transaction():
+            return self._enqueue(stage, key, payload, max_attempts, requeue, time.time())
+
+    @locked
+    def lease(self, stages, owner=None, lease_seconds=LEASE_SECONDS):
+        """Claim the oldest runnable job of the given stages, or None. Expired leases are reclaimed first."""
+        owner = owner or worker_name()
+        placeholders = ",".join("?" * len(stages))
+        with self._transaction():
+            now = time.time()
+            self._reclaim(now)
+            row = self.conn.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND stage IN ({placeholders}) AND not_before <= ? "
+                "ORDER BY id LIMIT 1", (READY, *stages, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                              "updated_at = ? WHERE id = ?", (LEASED, owner, now + lease_seconds, now, row["id"]))
+        job = self._job(row)
+        job.update(status=LEASED, lease_owner=owner, attempts=row["attempts"] + 1)
+        return job
+
+    def _reclaim(self, now):
+        expired = self.conn.execute("SELECT id, stage, key, lease_owner, attempts, max_attempts, rerun FROM jobs "
+                                    "WHERE status = ? AND lease_expires < ?", (LEASED, now)).fetchall()
+        for row in expired:
+            # Work queued while it ran gets a fresh set of attempts
+            dead = row["attempts"] >= row["max_attempts"] and not row["rerun"]
+            self.conn.execute("UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?, "
+                              "attempts = CASE WHEN rerun THEN 0 ELSE attempts END, rerun = 0, updated_at = ? "
+                              "WHERE id = ?",
+                              (DEAD if dead else READY, f"lease held by {row['lease_owner']} expired", now, row["id"]))
+            METRICS.incr("queue_leases_expired", stage=row["stage"])
+            logging.warning(f"Lease on {row['stage']} job {row['key']} held by {row['lease_owner']} expired"
+                            + (", moved to dead letters" if dead else ", requeued"))
+
+    @locked
+    def heartbeat(self, job, lease_seconds=LEASE_SECONDS):
+        """Extend the job's lease. Raises LeaseLost if another worker has taken it over."""
+        with self._transaction():
+            cursor = self.conn.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                                       "WHERE id = ? AND status = ? AND lease_owner = ?",
+                                       (time.time() + lease_seconds, time.time(), job["id"], LEASED,
+                                        job["lease_owner"]))
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"{job['stage']} job {job['key']}")
+
+    @locked
+    def complete(self, job, follow_ups=()):
+        """Mark the job done and queue its follow-up jobs [(stage, key, payload)] in the same transaction.
+
+        A job requeued while it ran goes back to ready instead, with its new payload and fresh attempts.
+        Returns False (and queues nothing) if the lease was lost, since another worker now owns the job.
+        """
+        with self._transaction():
+            now = time.time()
+            cursor = self.conn.execute("UPDATE jobs SET status = CASE WHEN rerun THEN ? ELSE ? END, "
+                                       "attempts = CASE WHEN rerun THEN 0 ELSE attempts END, rerun = 0, not_before = 0, "
+                                       "lease_owner = NULL, lease_expires = NULL, last_error = NULL, updated_at = ? "
+                                       "WHERE id = ? AND status = ? AND lease_owner = ?",
+                                       (READY, DONE, now, job["id"], LEASED, job["lease_owner"]))
+            if cursor.rowcount == 0:
+                return False
+            for stage, key, payload in follow_ups:
+                # New work for an album (a changed album, a fresh rewrite) reopens its finished downstream jobs
+                self._enqueue(stage, key, payload, MAX_ATTEMPTS, True, now)
+        return True
+
+    @locked
+    def fail(self, job, error):
+        """Record a failed attempt: retry later with backoff, or move to the dead letters when out of attempts.
+
+        Returns the job's new status (READY or DEAD), or None if the lease was lost and nothing was recorded.
+        """
+        with self._transaction():
+            now = time.time()
+            row = self.conn.execute("SELECT rerun FROM jobs WHERE id = ?", (job["id"],)).fetchone()
+            rerun = bool(row and row["rerun"])
+            # A job requeued while it ran retries its new payload right away, with fresh attempts
+            dead = job["attempts"] >= job["max_attempts"] and not rerun
+            delay = 0 if dead or rerun else backoff_delay(job["attempts"] - 1, RETRY_BASE, RETRY_CAP)
+            cursor = self.conn.execute("UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, not_before = ?, "
+                              "last_error = ?, attempts = CASE WHEN rerun THEN 0 ELSE attempts END, rerun = 0, "
+                              "updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                              (DEAD if dead else READY, now + delay, str(error)[:1000], now, job["id"], LEASED,
+                               job["lease_owner"]))
+        if cursor.rowcount == 0:
+            return None
+        METRICS.incr("queue_dead" if dead else "queue_retried", stage=job["stage"])
+        return DEAD if dead else READY
+
+    @locked
+    def dead_letters(self, stage=None):
+        if stage is None:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY updated_at", (DEAD,))
+        else:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE status = ? AND stage = ? ORDER BY updated_at",
+                                     (DEAD, stage))
+        return [self._job(r) for r in rows]
+
+    @locked
+    def requeue_dead(self, stage=None):
+        """Give dead jobs a fresh set of attempts. Returns how many were requeued."""
+        with self._transaction():
+            query = ("UPDATE jobs SET status = ?, attempts = 0, not_before = 0, last_error = NULL, updated_at = ? "
+                     "WHERE status = ?"
+                     + (" AND stage = ?" if stage else ""))
+            params = (READY, time.time(), DEAD) + ((stage,) if stage else ())
+            return self.conn.execute(query, params).rowcount
+
+    @locked
+    def counts(self):
+        """{stage: {status: n}}"""
+        counts = {}
+        for r in self.conn.execute("SELECT stage, status, COUNT(*) AS n FROM jobs GROUP BY stage, status"):
+            counts.setdefault(r["stage"], {})[r["status"]] = r["n"]
+        return counts
+
+    @locked
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error; the write lock is taken before anything is read."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class Heartbeat:
+    """Renews a job's lease in the background while it runs (`with Heartbeat(queue, job): ...`)."""
+
+    def __init__(self, queue, job, interval=HEARTBEAT_SECONDS, lease_seconds=LEASE_SECONDS):
+        self.queue = queue
+        self.job = job
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.job, self.lease_seconds)
+            except LeaseLost:
+                self.lost = True
+                logging.warning(f"Lost the lease on {self.job['stage']} job {self.job['key']}")
+                return
+            except sqlite3.Error as e:
+                logging.warning(f"Heartbeat for {self.job['stage']} job {self.job['key']} failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(queue, handlers, stop=None, owner=None, exit_when_idle=False):
+    """Lease and run jobs of the handled stages until stop is set (or the queue is drained, if exit_when_idle).
+
+    handlers maps a stage to func(payload) -> [(stage, key, payload)] follow-up jobs (or None).
+    Returns {"done": n, "failed": n, "lost": n}.
+    """
+    stop = stop or threading.Event()
+    owner = owner or worker_name()
+    stats = {"done": 0, "failed": 0, "lost": 0}
+    while not stop.is_set():
+        job = queue.lease(list(handlers), owner)
+        if job is None:
+            # Drained only once no stage has work left, since upstream jobs can still queue more
+            if exit_when_idle and not any(counts.get(READY) or counts.get(LEASED) for counts in queue.counts().values()):
+                break
+            stop.wait(IDLE_POLL)
+            continue
+        try:
+            with METRICS.span(f"job_{job['stage']}"), Heartbeat(queue, job) as beat:
+                follow_ups = handlers[job["stage"]](job["payload"]) or []
+        except Exception as e:
+            status = queue.fail(job, e)
+            if status is None:
+                # The lease expired while the job ran; its new owner decides what happens to it
+                stats["lost"] += 1
+                logging.warning(f"Job {job['stage']} {job['key']} failed after its lease was lost: {e}")
+                continue
+            stats["failed"] += 1
+            print(f"[!] {job['stage']} job {job['key']} failed (attempt {job['attempts']}/{job['max_attempts']}"
+                  f"{', moved to dead letters' if status == DEAD else ''}): {e}")
+            logging.error(f"Job {job['stage']} {job['key']} failed: {e}")
+            continue
+        if beat.lost or not queue.complete(job, follow_ups):
+            # Someone else owns the job now; its result from this run is discarded
+            stats["lost"] += 1
+            continue
+        stats["done"] += 1
+    return stats